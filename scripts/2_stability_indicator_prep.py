@@ -2,93 +2,146 @@ import pandas as pd
 import numpy as np
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.append('./')
 
-from utils.stability_indicators import calc_rocof, make_frequency_data_hdf
+from utils.stability_indicators import calc_rocof, calc_hourly_indicators, make_frequency_data_hdf
+from utils.stability_indicators import make_frequency_data_store, read_frequency_store
+from utils.stability_indicators import make_gap_index, hours_with_gaps, make_aggregate_pyramid
+from utils.pipeline import pipeline_selection, pipeline_parameter
+from utils.compact_dtypes import prepare_for_saving, save_compact_report
 
 
-# Time zones of frequency recordings
-tzs = {'CE':'CET', 'Nordic':'Europe/Helsinki', 'GB':'GB'}
+if __name__ == '__main__':
 
-# Datetime parameters for output data generation
-start = pd.Timestamp('2015-01-01 00:00:00', tz='UTC')
-end = pd.Timestamp('2019-12-31 00:00:00', tz='UTC')
-time_resol = pd.Timedelta('1H')
+    # Time zones of frequency recordings
+    tzs = {'CE':'CET', 'Nordic':'Europe/Helsinki', 'GB':'GB'}
 
-# Pre-processed frequency csv files
-frequency_csv_folder = '../Frequency_data_base/' 
-tso_names = {'GB': 'Nationalgrid', 'CE': 'TransnetBW', 'Nordic': 'Fingrid' } 
+    # Datetime parameters for output data generation
+    start = pd.Timestamp('2015-01-01 00:00:00', tz='UTC')
+    end = pd.Timestamp('2019-12-31 00:00:00', tz='UTC')
+    time_resol = pd.Timedelta('1H')
+
+    # Pre-processed frequency csv files
+    frequency_csv_folder = '../Frequency_data_base/' 
+    tso_names = {'GB': 'Nationalgrid', 'CE': 'TransnetBW', 'Nordic': 'Fingrid' } 
  
-# HDF frequency files (for faster access than csv files)
-frequency_hdf_folder = {'GB': '../Frequency_data_preparation/Nationalgrid/',
-                        'CE': '../Frequency_data_preparation/TransnetBW/',
-                        'Nordic': '../Frequency_data_preparation/Fingrid/' } 
+    # HDF frequency files (for faster access than csv files)
+    frequency_hdf_folder = {'GB': '../Frequency_data_preparation/Nationalgrid/',
+                            'CE': '../Frequency_data_preparation/TransnetBW/',
+                            'Nordic': '../Frequency_data_preparation/Fingrid/' } 
+
+    # Number of csv rows per chunk when streaming the csv files into the HDF files
+    # (None reads all years into memory at once)
+    hdf_chunk_size = 10**7
+
+    # Number of processes decoding the yearly csv files of one TSO 
+    # and whether the TSOs are converted in parallel as well
+    hdf_n_jobs = 5
+    parallel_tsos = True
+
+    # Nan treatment
+    skip_hour_with_nan = pipeline_parameter('skip_hour_with_nan', True)
+
+    # Parameters for rocof estimation
+    smooth_windows =  pipeline_parameter('smooth_windows', {'CE': 60, 'GB': 60, 'Nordic':30})
+    lookup_windows =   pipeline_parameter('lookup_windows', {'CE': 60, 'GB': 60, 'Nordic':30})
 
-# Nan treatment
-skip_hour_with_nan = True
 
-# Parameters for rocof estimation
-smooth_windows =  {'CE': 60, 'GB': 60, 'Nordic':30}
-lookup_windows =   {'CE': 60, 'GB': 60, 'Nordic':30}
+    # Compact dtypes (float32, small integers, categoricals) for saved intermediate data and report
+    # of the memory saved and of the deviations caused by them
+    compact_dtypes = pipeline_parameter('compact_dtypes', False)
+    compact_report_file = './results/compact_dtypes/2_stability_indicator_prep.csv'
+    compact_report = []
 
+    areas = pipeline_selection('areas', ['GB', 'CE', 'Nordic'])
 
-for area in ['GB', 'CE', 'Nordic']:
+    # If not existent, create HDF files from csv files 
+    # (for faster access when trying out things)
+    hdf_args = {area: (frequency_csv_folder, tso_names[area], frequency_hdf_folder[area], start, end, tzs[area])
+                for area in areas}
+    hdf_kwargs = {'chunk_size': hdf_chunk_size, 'n_jobs': hdf_n_jobs}
+    if parallel_tsos:
+        with ProcessPoolExecutor(max_workers=len(areas)) as pool:
+            hdf_files = {area: pool.submit(make_frequency_data_hdf, *hdf_args[area], **hdf_kwargs) for area in areas}
+        hdf_files = {area: future.result() for area, future in hdf_files.items()}
+    else:
+        hdf_files = {area: make_frequency_data_hdf(*hdf_args[area], **hdf_kwargs) for area in areas}
+
+
+    for area in areas:
     
-    print('\n######', area, '######')
+        print('\n######', area, '######')
     
-    # If not existent, create HDF file from csv files 
-    # (for faster access when trying out things)
-    hdf_file = make_frequency_data_hdf(frequency_csv_folder, tso_names[area], frequency_hdf_folder[area],
-                                       start, end, tzs[area])
+        hdf_file = hdf_files[area]
     
-    # Output data folder
-    folder = './data/{}/'.format(area)
-    if not os.path.exists(folder):
-        os.makedirs(folder)    
+        # Output data folder
+        folder = './data/{}/'.format(area)
+        if not os.path.exists(folder):
+            os.makedirs(folder)    
     
-    # Load frequency data 
-    freq = pd.read_hdf(hdf_file).loc[start:end]
-    freq = freq -50
-
-    # Setup datetime index for output data
-    index = pd.date_range(start, end, freq=time_resol, tz='UTC').tz_convert(tzs[area])
-    if os.path.exists(folder+'outputs.h5'):
-        outputs= pd.read_hdf(folder+'outputs.h5')           
-    else:
-        outputs = pd.DataFrame(index= index)
+        # Load frequency data 
+        # (from a compact millihertz store that is created once from the HDF file,
+        # only the samples between start and end are read from the memory-mapped store)
+        store_file = make_frequency_data_store(hdf_file)
+        if store_file is not None:
+            gap_file = make_gap_index(store_file)
+            freq = read_frequency_store(store_file, start, end)
+    
+            # Per-minute aggregates of the frequency data 
+            # (to explore indicators at other time resolutions with calc_aggregate_indicators)
+            make_aggregate_pyramid(store_file)
+        else:
+            # Data finer than 1 mHz is read from the HDF file (on a gap-free time index as the store)
+            freq = pd.read_hdf(hdf_file).loc[start:end]
+            freq = freq.reindex(pd.date_range(freq.index[0], freq.index[-1], freq=freq.index[1]-freq.index[0]))
+        freq = freq -50
+
+        # Setup datetime index for output data
+        index = pd.date_range(start, end, freq=time_resol, tz='UTC').tz_convert(tzs[area])
+        if os.path.exists(folder+'outputs.h5'):
+            outputs= pd.read_hdf(folder+'outputs.h5')           
+        else:
+            outputs = pd.DataFrame(index= index)
         
-    # Extract stability indicators  
-    print('Extracting stability indicators ...')
-    outputs['f_integral'] = freq.groupby(pd.Grouper(freq='1H')).sum()
-    outputs['f_ext'] = freq.groupby(pd.Grouper(freq='1H')).apply(lambda x: x[x.abs().idxmax()] if x.notnull().any() else np.nan)
-    outputs['f_rocof'] = calc_rocof(freq, smooth_windows[area], lookup_windows[area])
-    outputs['f_msd'] = (freq**2).groupby(pd.Grouper(freq='1H')).mean()
+        # Extract stability indicators  
+        # (hourly indicators are calculated in one pass over the data)
+        print('Extracting stability indicators ...')
+        hourly_indicators, hours_with_nans = calc_hourly_indicators(freq)
+        outputs['f_integral'] = hourly_indicators.f_integral
+        outputs['f_ext'] = hourly_indicators.f_ext
+        outputs['f_rocof'] = calc_rocof(freq, smooth_windows[area], lookup_windows[area])
+        outputs['f_msd'] = hourly_indicators.f_msd
     
-    # Set hour to NaN if frequency contains at least one NaN in that hour
-    if skip_hour_with_nan==True:
-        hours_with_nans = freq.groupby(pd.Grouper(freq='1H')).apply(lambda x: x.isnull().any())
-        outputs.loc[hours_with_nans]=np.nan
+        # Set hour to NaN if frequency contains at least one NaN in that hour
+        # (looked up in the index of NaN gaps)
+        if skip_hour_with_nan==True:
+            if store_file is not None:
+                hours_with_nans = hours_with_gaps(store_file, gap_file, start, end)
+            outputs.loc[hours_with_nans]=np.nan
     
-    # Save data 
-    outputs.to_hdf(folder+'outputs.h5', key='df')
+        # Save data 
+        outputs = prepare_for_saving(outputs, compact_dtypes, compact_report, '2_stability_indicator_prep', area, 'outputs')
+        outputs.to_hdf(folder+'outputs.h5', key='df')
     
-    # Save outputs also for "country"-areas
-    if area=='CE':
-        folder = './data/{}/'.format('DE')
-        if not os.path.exists(folder):
-            os.makedirs(folder)   
-        outputs.to_hdf(folder+'outputs.h5', key='df')     
+        # Save outputs also for "country"-areas
+        if area=='CE':
+            folder = './data/{}/'.format('DE')
+            if not os.path.exists(folder):
+                os.makedirs(folder)   
+            outputs.to_hdf(folder+'outputs.h5', key='df')     
 
-        folder = './data/{}/'.format('CH')
-        if not os.path.exists(folder):
-            os.makedirs(folder)   
-        outputs.to_hdf(folder+'outputs.h5', key='df')   
+            folder = './data/{}/'.format('CH')
+            if not os.path.exists(folder):
+                os.makedirs(folder)   
+            outputs.to_hdf(folder+'outputs.h5', key='df')   
           
-    if area=='Nordic':
-        folder = './data/{}/'.format('SE')
-        if not os.path.exists(folder):
-            os.makedirs(folder)   
-        outputs.to_hdf(folder+'outputs.h5', key='df')     
-        
-        
\ No newline at end of file
+        if area=='Nordic':
+            folder = './data/{}/'.format('SE')
+            if not os.path.exists(folder):
+                os.makedirs(folder)   
+            outputs.to_hdf(folder+'outputs.h5', key='df')
+
+    if compact_dtypes:
+        save_compact_report(compact_report, compact_report_file)
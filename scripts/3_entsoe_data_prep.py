@@ -1,23 +1,36 @@
 import os
+import json
 import pandas as pd 
-from matplotlib import pyplot as plt
-import matplotlib
-matplotlib.use('agg')
 
 import sys
 
 sys.path.append('./')
 
-from utils.entsoe_processing import calc_mean_bzn_load,aggregate_external_features
-from utils.entsoe_processing import extract_region_variable_contrib, save_region_variable_contrib
+from utils.entsoe_processing import calc_mean_bzn_loads,aggregate_external_features
+from utils.entsoe_processing import extract_region_variable_contribs, prepare_region_variable_contrib, update_contribution_store
+from utils.entsoe_processing import read_ingest_manifest, write_ingest_manifest, pending_monthly_files
+from utils.pipeline import pipeline_parameter
+from utils.compact_dtypes import prepare_for_saving, save_compact_report
 
 
 # Areas inlcuding "country" areas
 areas = ['CE', 'GB', 'Nordic', 'SE', 'CH', 'DE']
 
+# Maximum ratio of hours with missing data when aggregating the contributions
+final_nan_ratio_limit = pipeline_parameter('final_nan_ratio_limit', 0.37)
+
+# Compact dtypes (float32, small integers, categoricals) for saved intermediate data and report
+# of the memory saved and of the deviations caused by them
+compact_dtypes = pipeline_parameter('compact_dtypes', False)
+compact_report_file = './results/compact_dtypes/3_entsoe_data_prep.csv'
+compact_report = []
+
 # Path to ENTSO-E downloaded data
 entsoe_data_folder = '../../External_data/ENTSO-E/' 
 
+# Cache for parsed monthly files (re-parsed only if a file changes)
+parse_cache_folder = entsoe_data_folder + 'parse_cache/'
+
 # Path for generated features and tragets
 folder = './data/{}/'
 
@@ -161,47 +174,73 @@ file_props = {
 
 print('\nCollect region contributions\n')
 
-# Iterate over areas
-for area in areas:
-
-    print('###################### ', area, ' ##########################')
+# Manifest of ingested monthly files 
+# (only new or changed months are processed and merged into the contribution stores of the areas)
+ingest_manifest_file = entsoe_data_folder + 'ingested_files.json'
+contrib_store_files = {area: entsoe_data_folder + 'region_contributions_{}.npy'.format(area) for area in areas}
+settings = json.loads(json.dumps({'start': str(start), 'time_resolution': str(time_resol),
+                                  'file_props': file_props, 'areas': areas}))
+ingest_manifest = read_ingest_manifest(ingest_manifest_file, settings, end, contrib_store_files.values())
+time_index = pd.date_range(start, end, freq=time_resol)
+
+# (Re-)build contribution stores from scratch if no file has been ingested yet
+if not ingest_manifest['files']:
+    for contrib_store_file in contrib_store_files.values():
+        for file in [contrib_store_file, contrib_store_file[:-4] + '.json']:
+            if os.path.exists(file):
+                os.remove(file)
+
+#Iterate over file types from ENTSO-E server
+for file_type, file_type_props in file_props.items():
+
+    print('######## ',file_type,' #########')
+    
+    # New or changed monthly files
+    pending_files = pending_monthly_files(entsoe_data_folder, file_type, start, end, time_resol, ingest_manifest)
+    if not pending_files:
+        print('No new or changed files')
+        continue
     
-    # Prepare processing for this area
-    if os.path.exists(entsoe_data_folder + 'region_contributions_{}.h5'.format(area)):
-        os.remove(entsoe_data_folder + 'region_contributions_{}.h5'.format(area))
-    contrib_info = pd.DataFrame(columns=['region','variable','nan_ratio','number_neg_vals', 'mean'])
+    # Extract the contributions of all regions within all areas 
+    # (each monthly file is read only once)
+    all_regions = []
+    for area in areas:
+        for region_list in file_type_props['regions'][area].values():
+            all_regions += [region for region in region_list if region not in all_regions]
     
-    #Iterate over file types from ENTSO-E server
-    for file_type, file_type_props in file_props.items():
+    monthly_contributions = []
+    for file, first, last, entry in pending_files:
+        monthly_contributions.append(extract_region_variable_contribs(entsoe_data_folder = entsoe_data_folder,
+                                                                      file_type = file_type, regions = all_regions,
+                                                                      variable_name = file_type_props['vals'],
+                                                                      pivot_column_name = file_type_props['value_cols'],
+                                                                      column_rename_dict = file_type_props['new_cols'],
+                                                                      start_time = first, end_time = last,
+                                                                      time_resolution = time_resol,
+                                                                      cache_folder = parse_cache_folder))
+    
+    # Iterate over areas
+    for area in areas:
 
-        print('######## ',file_type,' #########')
+        print('###################### ', area, ' ##########################')
        
-        # Iterate over region types within the area
+        # Collect the new rows of all regions within the area
+        area_contributions = []
         for region_type, region_list in file_type_props['regions'][area].items():  
-            
-            # Iterate over regions of this type
             for region in region_list:            
-         
-                
-                reg_var_contribution = extract_region_variable_contrib(entsoe_data_folder = entsoe_data_folder,
-                                                                       file_type = file_type, region = region,
-                                                                       variable_name = file_type_props['vals'],
-                                                                       pivot_column_name = file_type_props['value_cols'],
-                                                                       column_rename_dict = file_type_props['new_cols'],
-                                                                       start_time = start, end_time = end,
-                                                                       time_resolution = time_resol)
-                
-                hdf_file = entsoe_data_folder + 'region_contributions_{}.h5'.format(area)
-                
-                region_contrib_info = save_region_variable_contrib(contribution = reg_var_contribution,
-                                                                   region = region,
-                                                                   path_to_hdf_file = hdf_file,
-                                                                   path_to_doc_folder = doc_folder.format(area))
-                
-                contrib_info = contrib_info.append(region_contrib_info)
                 
-                
-    contrib_info.to_csv(doc_folder.format(area)+'contribution_info.csv')
+                region_contribution = pd.concat([contributions[region] for contributions in monthly_contributions])
+                area_contributions.append(prepare_region_variable_contrib(contribution = region_contribution,
+                                                                          region = region))
+        
+        # Merge them into the contribution store of the area
+        update_contribution_store(contrib_store_files[area],
+                                  pd.concat(area_contributions, axis=1), time_index)
+    
+    # Record ingested files
+    for file, first, last, entry in pending_files:
+        ingest_manifest['files'][os.path.basename(file)] = entry
+    write_ingest_manifest(ingest_manifest, ingest_manifest_file)
     
 
 #### Collect mean load for bidding zones ###
@@ -213,13 +252,8 @@ for area in areas:
     
     print('########### ', area, ' ###########')
 
-    mean_bzn_load = pd.Series()
-    
-    # Iterate over bidding zones
-    for region in bzn_area_names[area]['BZN']:  
-                  
-        mean_bzn_load.loc[region] = calc_mean_bzn_load(entsoe_data_folder,region,start,end)
-
+    # Scan load files once for all bidding zones
+    mean_bzn_load = calc_mean_bzn_loads(entsoe_data_folder,bzn_area_names[area]['BZN'],start,end,parse_cache_folder)
 
     # Save results
     mean_bzn_load.to_csv(doc_folder.format(area)+'mean_bzn_load.csv', header=False) 
@@ -236,52 +270,22 @@ for area in areas:
 
     mean_bzn_load = pd.read_csv(doc_folder.format(area) + 'mean_bzn_load.csv', header=None,
                                 index_col=0, squeeze=True) 
-    region_contrib_path = entsoe_data_folder + 'region_contributions_{}.h5'.format(area)
-    contrib_info = pd.read_csv(doc_folder.format(area) + 'contribution_info.csv', index_col=0) 
+    contrib_store_file = contrib_store_files[area]
     outputs = pd.read_hdf(folder.format(area) + 'outputs.h5')
     
-    raw_input_data, omitted_contribs = aggregate_external_features(region_contrib_path= region_contrib_path,
+    raw_input_data, omitted_contribs = aggregate_external_features(contrib_store_file=contrib_store_file,
                                                                    mean_bzn_load=mean_bzn_load,
-                                                                   contrib_info=contrib_info,
                                                                    output_data= outputs,
                                                                    start_time=start, end_time=end,
                                                                    time_resolution=time_resol, 
-                                                                   final_nan_ratio_limit=0.37)
+                                                                   final_nan_ratio_limit=final_nan_ratio_limit)
 
     # Save (final) raw input data
     raw_input_data.index = raw_input_data.index.tz_localize('UTC')
+    raw_input_data = prepare_for_saving(raw_input_data, compact_dtypes, compact_report, '3_entsoe_data_prep', area,
+                                        'raw_input_data')
     raw_input_data.to_hdf(folder.format(area)+'raw_input_data.h5', key='df')
     omitted_contribs.to_csv(doc_folder.format(area) + 'omitted_contributions.csv')
 
-
-#### Analysis of omitted contributions (during aggregation)  ####
-
-print('\nAnalysis of omitted contributions\n')
-
-for area in areas:
-    omitted_contribs = pd.read_csv(doc_folder.format(area)+'omitted_contributions.csv')
-    
-    try:
-        fig,ax=plt.subplots(figsize=(9,4))
-        data = omitted_contribs.pivot(index='variable', columns='region', values='ratio_var')
-        data = data.loc[:,data.sum()>0.001]
-        data.plot.bar(stacked=True, legend=False, cmap='tab20', ax=ax)
-        plt.xlabel('')
-        plt.ylabel('Mean omission / variable mean')
-        plt.legend(bbox_to_anchor=(0.8,0.5,0.5,0.5))
-        plt.savefig(doc_folder.format(area) + 'omitted_contributions_relative_to_variable_mean.svg', bbox_inches='tight')
-        plt.show()
-        plt.close()
-
-        fig,ax=plt.subplots(figsize=(9,4))
-        data = omitted_contribs.pivot(index='variable', columns='region', values='ratio_load')
-        data = data.loc[:,data.sum()>0.001].drop(index=['prices_day_ahead'])
-        data.plot.bar(stacked=True, legend=False, cmap='tab20', ax=ax)
-        plt.xlabel('')
-        plt.ylabel('Mean omission / total mean load')
-        plt.legend(bbox_to_anchor=(0.8,0.5,0.5,0.5))
-        plt.savefig(doc_folder.format(area) + 'omitted_contributions_relative_to_mean_load.svg', bbox_inches='tight')
-
-    except:
-        pass
-
+if compact_dtypes:
+    save_compact_report(compact_report, compact_report_file)
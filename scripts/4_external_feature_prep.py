@@ -1,106 +1,80 @@
 import pandas as pd 
-from matplotlib import pyplot as plt 
+import sys
 import os
-import matplotlib
-matplotlib.use('agg')
+import json
 
-# Day-ahead available and actual (ex-post) features from ENTSO-E data
-actual_cols = ['load', 'gen_biomass', 'gen_lignite', 'gen_coal_gas', 'gen_gas',
-               'gen_hard_coal', 'gen_oil', 'gen_oil_shale', 'gen_fossil_peat',
-               'gen_geothermal', 'gen_pumped_hydro', 'gen_run_off_hydro',
-               'gen_reservoir_hydro', 'gen_marine', 'gen_nuclear', 'gen_other_renew',
-               'gen_solar', 'gen_waste', 'gen_wind_off', 'gen_wind_on', 'gen_other']
-
-forecast_cols = ['load_day_ahead', 'scheduled_gen_total','prices_day_ahead',
-                 'solar_day_ahead','wind_off_day_ahead', 'wind_on_day_ahead']
+sys.path.append('./')
 
+from utils.pipeline import pipeline_selection, pipeline_parameter
+from utils.compact_dtypes import prepare_for_saving, save_compact_report
+from utils.feature_engine import feature_specs, compile_features, plan_hash, evaluate_feature_frames, first_changed_hour
 
 # Areas inlcuding "country" areas
-areas = ['CE', 'GB', 'Nordic', 'SE', 'CH', 'DE']
+areas = pipeline_selection('areas', ['CE', 'GB', 'Nordic', 'SE', 'CH', 'DE'])
 
 # Time zones of frequency recordings
 tzs = {'GB':'GB', 'Nordic':'Europe/Helsinki', 'CE':'CET', 'DE':'CET', 'SE':'Europe/Helsinki', 'CH':'CET'}
 
+# Compact dtypes (float32, small integers, categoricals) for saved intermediate data and report
+# of the memory saved and of the deviations caused by them
+compact_dtypes = pipeline_parameter('compact_dtypes', False)
+compact_report_file = './results/compact_dtypes/4_external_feature_prep.csv'
+compact_report = []
+
+# Only refresh the features of new or changed hours if the features were saved before
+# (engineered features are declared in utils/feature_engine.py)
+incremental = pipeline_parameter('incremental', True)
+
 
 for area in areas:
 
     print('Processing external features from', area)
     
     # Setup folder paths to raw input data 
+    # (histograms of the raw input data are plotted in a separate documentation stage)
     folder = './data/{}/'.format(area)
-    doc_folder = folder + 'documentation_of_data_download/'
-    if not os.path.exists(doc_folder):
-        os.makedirs(doc_folder)
 
     # Load the pre-processed external features
     raw_input_data = pd.read_hdf(folder + 'raw_input_data.h5')
 
-    # Inspection of data distribution as histograms
-    fig,ax=plt.subplots(figsize=(20,20))
-    raw_input_data.hist(log=True,ax=ax, bins=100)
-    plt.tight_layout()
-    plt.savefig(doc_folder+'raw_data_histograms.svg', bbox_inches='tight')
-    plt.close()
-
-    # Split into forecast and actual data and convert index to local timezone of frequency data
-    input_forecast = raw_input_data.loc[:, raw_input_data.columns.intersection(forecast_cols)]
-    input_actual = raw_input_data.loc[:, raw_input_data.columns.intersection(actual_cols)]
-    input_actual.index = input_actual.index.tz_convert(tzs[area])
-    input_forecast.index = input_forecast.index.tz_convert(tzs[area])
-
-    ####  Additional engineered features ###
-    
-    # Time
-    input_forecast['month'] = input_forecast.index.month
-    input_forecast['weekday'] =  input_forecast.index.weekday
-    input_forecast['hour'] =  input_forecast.index.hour
-
-    # Total generation
-    input_actual['total_gen'] = input_actual.filter(regex='^gen').sum(axis='columns')
-
-
-    # Inertia proxy - Sum of all synchronous generation
-    input_actual['synchronous_gen'] = input_actual.total_gen- input_actual.loc[:,['gen_solar',
-                                                                                  'gen_wind_off',
-                                                                                  'gen_wind_on']].sum(axis=1)
-
-    # Ramps of load and total generation 
-    input_forecast['load_ramp_day_ahead'] = input_forecast.load_day_ahead.diff()
-    input_actual['load_ramp'] = input_actual.load.diff()
-    input_forecast['total_gen_ramp_day_ahead'] = input_forecast.scheduled_gen_total.diff()
-    input_actual['total_gen_ramp'] = input_actual.total_gen.diff()
-
-
-    # Ramps of generaton types
-    if 'wind_off_day_ahead' in input_forecast.columns:
-        input_forecast['wind_off_ramp_day_ahead'] = input_forecast.wind_off_day_ahead.diff()
-    input_forecast['wind_on_ramp_day_ahead'] = input_forecast.wind_on_day_ahead.diff()
-    if 'solar_day_ahead' in input_forecast.columns:
-        input_forecast['solar_ramp_day_ahead'] = input_forecast.solar_day_ahead.diff()
-    gen_ramp_cols = input_actual.filter(regex='^gen').columns.str[4:] + '_ramp'
-    input_actual[gen_ramp_cols] = input_actual.filter(regex='^gen').diff()
-
-    # Price Ramps
-    input_forecast['price_ramp_day_ahead'] = input_forecast.prices_day_ahead.diff()
-
-    # Forecast errors
-    input_actual['forecast_error_wind_on'] = input_forecast.wind_on_day_ahead - input_actual.gen_wind_on
-    if 'wind_off_day_ahead' in input_forecast.columns:
-        input_actual['forecast_error_wind_off'] = input_forecast.wind_off_day_ahead - input_actual.gen_wind_off
-        input_actual['forecast_error_wind_off_ramp'] = input_forecast.wind_off_ramp_day_ahead - input_actual.wind_off_ramp
-    input_actual['forecast_error_total_gen'] = input_forecast.scheduled_gen_total - input_actual.total_gen
-    input_actual['forecast_error_load'] = input_forecast.load_day_ahead - input_actual.load
-    input_actual['forecast_error_load_ramp'] = input_forecast.load_ramp_day_ahead - input_actual.load_ramp
-    input_actual['forecast_error_total_gen_ramp'] = input_forecast.total_gen_ramp_day_ahead - input_actual.total_gen_ramp
-    input_actual['forecast_error_wind_on_ramp'] = input_forecast.wind_on_ramp_day_ahead - input_actual.wind_on_ramp
-    if 'solar_day_ahead' in input_forecast.columns:
-        input_actual['forecast_error_solar_ramp'] = input_forecast.solar_ramp_day_ahead - input_actual.solar_ramp
-        input_actual['forecast_error_solar'] = input_forecast.solar_day_ahead - input_actual.gen_solar
-
+    # Evaluation plan of the engineered features for the available input columns
+    plan = compile_features(feature_specs, raw_input_data.columns)
+    feature_state = {'plan': plan_hash(plan), 'compact_dtypes': compact_dtypes}
+    feature_state_file = folder + 'input_features.json'
+
+    # First hour with new or changed inputs if features of the same plan were saved before
+    start = 0
+    if incremental and os.path.exists(feature_state_file) and os.path.exists(folder+'input_actual.h5') and os.path.exists(folder+'input_forecast.h5'):
+        with open(feature_state_file) as f:
+            if json.load(f)==feature_state:
+                saved_actual = pd.read_hdf(folder+'input_actual.h5')
+                saved_forecast = pd.read_hdf(folder+'input_forecast.h5')
+                start = first_changed_hour(plan, raw_input_data, saved_actual, saved_forecast)
+
+    if start==raw_input_data.shape[0]:
+        print('Features are up to date')
+        continue
+
+    # Split into forecast and actual data in the local timezone of the frequency data and
+    # evaluate the engineered features (for the hours from start on)
+    input_actual, input_forecast = evaluate_feature_frames(plan, raw_input_data, tzs[area], start)
+    if start > 0:
+        print('Refreshing features from', input_actual.index[0])
+        input_actual = pd.concat([saved_actual.iloc[:start], input_actual])
+        input_forecast = pd.concat([saved_forecast.iloc[:start], input_forecast])
 
     # Save data
+    input_actual = prepare_for_saving(input_actual, compact_dtypes, compact_report, '4_external_feature_prep', area,
+                                      'input_actual')
+    input_forecast = prepare_for_saving(input_forecast, compact_dtypes, compact_report, '4_external_feature_prep', area,
+                                        'input_forecast')
     input_actual.to_hdf(folder+'input_actual.h5',key='df')
     input_forecast.to_hdf(folder+'input_forecast.h5',key='df')
+    with open(feature_state_file, 'w') as f:
+        json.dump(feature_state, f)
+
+if compact_dtypes and compact_report:
+    save_compact_report(compact_report, compact_report_file)
 
 
 
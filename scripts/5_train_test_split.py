@@ -1,12 +1,30 @@
 import pandas as pd 
+import numpy as np
 from sklearn import model_selection
 import os
+import sys
+
+sys.path.append('./')
+
+from utils.pipeline import pipeline_selection, pipeline_parameter
+from utils.compact_dtypes import prepare_for_saving, save_compact_report
+from utils.split_store import save_split_table, save_split
 
 # Choose subset of targets if required
-targets = ['f_integral', 'f_rocof', 'f_ext', 'f_msd']
+targets = pipeline_parameter('targets', ['f_integral', 'f_rocof', 'f_ext', 'f_msd'])
 
 # Areas inlcuding "country" areas
-areas = ['CE', 'GB', 'Nordic', 'SE', 'CH', 'DE']
+areas = pipeline_selection('areas', ['CE', 'GB', 'Nordic', 'SE', 'CH', 'DE'])
+
+# Version of train-test data
+data_version = pipeline_parameter('data_version', '2021-07-01') #pd.Timestamp("today").strftime("%Y-%m-%d")
+
+
+# Compact dtypes (float32, small integers, categoricals) for saved intermediate data and report
+# of the memory saved and of the deviations caused by them
+compact_dtypes = pipeline_parameter('compact_dtypes', False)
+compact_report_file = './results/compact_dtypes/5_train_test_split.csv'
+compact_report = []
 
 
 for area in areas:
@@ -15,7 +33,7 @@ for area in areas:
    
    # Setup folder for this specific version of train-test data
    folder = './data/{}/'.format(area)
-   version_folder = folder + 'version_'+ '2021-07-01/' #pd.Timestamp("today").strftime("%Y-%m-%d") + '/'
+   version_folder = folder + 'version_'+ data_version + '/'
    if not os.path.exists(version_folder):
       os.makedirs(version_folder)
    
@@ -28,23 +46,21 @@ for area in areas:
    valid_ind =  ~pd.concat([X_forecast, X_actual, y], axis=1).isnull().any(axis=1)
    X_forecast, X_actual, y = X_forecast[valid_ind], X_actual[valid_ind], y[valid_ind]
 
-   # Join features for full model
+   # Join features for full model and targets
    X_full = X_actual.join(X_forecast)
+   data = X_full.join(y)
+
+   # Save joined data once with column groups for full model and restricted (day-ahead) model
+   data = prepare_for_saving(data, compact_dtypes, compact_report, '5_train_test_split', area, 'split_table')
+   save_split_table(version_folder, data, {'full': X_full.columns, 'day_ahead': X_forecast.columns, 'targets': y.columns})
+
+   # Train-test split as row positions of the joined data
+   # (further split schemes, e.g. other seeds or time-based folds, only add another small file)
+   train_rows, test_rows = model_selection.train_test_split(np.arange(data.shape[0]), test_size=0.2, random_state=42)
+   save_split(version_folder, 'random', train_rows, test_rows)
 
-   # Train-test split
-   X_train_full, X_test_full, y_train, y_test = model_selection.train_test_split(X_full, y, test_size=0.2, random_state=42)
-   X_train_day_ahead = X_forecast.loc[X_train_full.index]
-   X_test_day_ahead = X_forecast.loc[X_test_full.index]
-   y_pred=pd.DataFrame(index=y_test.index)
-
-   # Save data for full model and restricted (day-ahead) model
-   X_train_full.to_hdf(version_folder+'X_train_full.h5',key='df')
-   X_train_day_ahead.to_hdf(version_folder+'X_train_day_ahead.h5',key='df')
-   y_train.to_hdf(version_folder+'y_train.h5',key='df')
-   y_test.to_hdf(version_folder+'y_test.h5',key='df')
-   y_pred.to_hdf(version_folder+'y_pred.h5',key='df')
-   X_test_full.to_hdf(version_folder+'X_test_full.h5',key='df')
-   X_test_day_ahead.to_hdf(version_folder+'X_test_day_ahead.h5',key='df')
+if compact_dtypes:
+   save_compact_report(compact_report, compact_report_file)
 
 
 
@@ -1,114 +1,146 @@
-import pandas as pd 
 import numpy as np 
-from sklearn.model_selection import GridSearchCV, train_test_split
+from sklearn.model_selection import train_test_split
 import os
 import time
-import shap
-import xgboost as xgb
-from sklearn.metrics import r2_score
+import sys
+import shutil
+
+sys.path.append('./')
+
+from utils.pipeline import pipeline_selection, pipeline_parameter
+from utils.compact_dtypes import save_compact_report
+from utils.split_store import open_split_table, read_split_rows, split_frame
+from utils.hyper_parameter_search import search_matrices, search_tasks
+from utils.job_scheduler import task, run_tasks
+from utils.model_fit import checkpoint_path, save_search_results, refit_model, save_shap_values, save_predictions, prediction_report
 
 # Setup 
-areas = ['DE','GB', 'CE', 'SE', 'CH', 'Nordic']  
-data_version = '2021-07-01'
-targets = ['f_integral', 'f_ext', 'f_msd', 'f_rocof']
+areas = pipeline_selection('areas', ['DE','GB', 'CE', 'SE', 'CH', 'Nordic'])
+data_version = pipeline_parameter('data_version', '2021-07-01')
+targets = pipeline_selection('targets', ['f_integral', 'f_ext', 'f_msd', 'f_rocof'])
+split_scheme = pipeline_parameter('split_scheme', 'random')
+
+# Hyper-parameter search: exhaustive 'grid' search or successive 'halving' over the same grid
+# (results of the halving search are saved with suffix '_halving' together with a report of
+# its cost and of the score of the chosen parameters in the exhaustive grid, if available)
+search = pipeline_parameter('search', 'grid')
+
+# Parameters for hyper-parameter optimization
+params_grid = {
+    'max_depth': [3,5,7,9,11],
+    'learning_rate':[0.01,0.05,0.1],
+    'subsample': [1,0.7,0.4],
+    'min_child_weight':[1,5,10,30],
+    'reg_lambda':[ 0.1, 1, 10]
+}
+
+# All (area, target, model type)-jobs are run as one task graph on a budget of cores: CV fits of each
+# configuration (single core), refits with the best parameters (refit_cores) and SHAP calculations 
+# (single core) are packed onto the free cores, so that e.g. the refit and SHAP calculations of one
+# target overlap with the search of the next target
+n_cores = pipeline_parameter('n_cores', 25)
+refit_cores = pipeline_parameter('refit_cores', 8)
+
+# Completed CV fits, search results, refits and SHAP values are checkpointed in the checkpoints folder
+# of each result folder, so that an interrupted run resumes where it stopped (checkpoints of changed
+# data or parameters are not used). With resume=False the checkpoints are removed and all is refitted.
+resume = pipeline_parameter('resume', True)
+
+# Report of the R2 scores and predictions with compact dtypes compared to a reference run 
+# (e.g. the data version prepared with float64 data)
+compact_dtypes = pipeline_parameter('compact_dtypes', False)
+reference_data_version = pipeline_parameter('reference_data_version', None)
+if reference_data_version==data_version:
+    print('Reference data version is the fitted data version, only the R2 scores are reported')
+    reference_data_version = None
+compact_report_file = './results/compact_dtypes/6_model_fit.csv'
+compact_report = []
 
 start_time = time.time()
 
+tasks = []
+
 for area in areas:
     
     print('---------------------------- ', area, ' ------------------------------------')
     
     data_folder = './data/{}/version_{}/'.format(area,data_version)
 
+    # Load feature data (identical for all targets) from the joined table of the data version
+    split_table = open_split_table(data_folder)
+    split_rows = read_split_rows(data_folder, split_scheme)
+    X = {(part, model_type): split_frame(split_table, split_rows[part], model_type[1:])
+         for part in ['train', 'test'] for model_type in ['_day_ahead','_full']}
+
+    # Split training set into (smaller) training set and validation set (the same for all targets) and
+    # build the xgboost matrices of the CV folds for the hyper-parameter search once for all targets
+    train_rows, val_rows = train_test_split(np.arange(X['train', '_full'].shape[0]), test_size=0.2, random_state=42)
+    matrices = {model_type: search_matrices(X['train', model_type].values, train_rows, val_rows, cv=5)
+                for model_type in ['_day_ahead','_full']}
+
+    # The searches of an area and model type share the labels of the matrices and run one target after the other
+    previous_search = {model_type: [] for model_type in ['_day_ahead','_full']}
+
     for target in targets: 
         
-        print('-------- ', target, ' --------')
-        
         # Result folder where prediction, SHAP values and CV results are saved
         res_folder = './results/model_fit/{}/version_{}/target_{}/'.format(area,data_version, target)
 
         if not os.path.exists(res_folder):
             os.makedirs(res_folder)
+        if not resume and os.path.exists(res_folder + 'checkpoints/'):
+            shutil.rmtree(res_folder + 'checkpoints/')
         
         # Load target data
-        y_train = pd.read_hdf(data_folder+'y_train.h5').loc[:, target]
-        y_test = pd.read_hdf(data_folder+'y_test.h5').loc[:, target]
-        y_pred = pd.read_hdf(data_folder+'y_pred.h5') #contains only time index
+        y_train = split_frame(split_table, split_rows['train'], [target])[target]
+        y_test = split_frame(split_table, split_rows['test'], [target])[target]
 
+        fits = []
         for model_type in ['_day_ahead','_full']:
 
-            # Load feature data
-            X_train = pd.read_hdf(data_folder+'X_train{}.h5'.format(model_type))
-            X_test = pd.read_hdf(data_folder+'X_test{}.h5'.format(model_type)) 
-          
-            # Daily profile prediction
-            daily_profile = y_train.groupby(X_train.index.time).mean()
-            y_pred['daily_profile'] = [daily_profile[time] for time in X_test.index.time]
-
-            # Mean predictor
-            y_pred['mean_predictor'] = y_train.mean()
+            name = '{}/{}/gtb{}'.format(area, target, model_type)
+            fit = {'name': name, 'res_folder': res_folder, 'model_type': model_type, 'search': search,
+                   'params_grid': params_grid, 'search_result': {},
+                   'X_train': X['train', model_type], 'X_test': X['test', model_type], 'y_train': y_train, 'y_test': y_test}
+            fits.append(fit)
 
             #### Gradient boosting Regressor CV hyperparameter optimization ###
 
-            # Split training set into (smaller) training set and validation set
-            X_train_train, X_train_val, y_train_train, y_train_val = train_test_split(X_train, y_train,
-                                                                                        test_size=0.2)
-            # Parameters for hyper-parameter optimization
-            params_grid = {
-                'max_depth': [3,5,7,9,11],
-                'learning_rate':[0.01,0.05,0.1],
-                'subsample': [1,0.7,0.4],
-                'min_child_weight':[1,5,10,30],
-                'reg_lambda':[ 0.1, 1, 10]
-            }
-            fit_params = {
-                'eval_set':[(X_train_train, y_train_train),(X_train_val, y_train_val)],
-                'early_stopping_rounds':20, 
-                'verbose':0
-            }
-            
-            # Grid search for optimal hyper-parameters
-            grid_search = GridSearchCV(xgb.XGBRegressor(objective='reg:squarederror', n_estimators=1000,
-                                                        verbosity=0, n_jobs=1, base_score = y_train.mean()),
-                                    params_grid, verbose=1, n_jobs=25, cv=5)
-
-            grid_search.fit(X_train_train, y_train_train, **fit_params)
-            
-            # Save CV results
-            pd.DataFrame(grid_search.cv_results_).to_csv(res_folder+'cv_results_gtb{}.csv'.format(model_type))
-
-            # Save best params (including n_estimators from early stopping on validation set)
-            best_params = grid_search.best_estimator_.get_params()
-            best_params['n_estimators'] = grid_search.best_estimator_.best_ntree_limit
-            pd.DataFrame(best_params, index=[0]).to_csv(res_folder+'cv_best_params_gtb{}.csv'.format(model_type))
-
-            # Gradient boosting regression best model evaluation on test set
-            best_params = pd.read_csv(res_folder+'cv_best_params_gtb{}.csv'.format(model_type),
-                                      usecols = list(params_grid.keys()) + ['n_estimators', 'base_score', 'objective'])
-            best_params = best_params.to_dict('records')[0]
-            best_params['n_jobs'] = 25
-            print('Number of opt. boosting rounds:', best_params['n_estimators'] )
-            
-            # Train on whole training set (including validation set)
-            model = xgb.XGBRegressor(**best_params)
-            model.fit(X_train, y_train)
+            # Search for optimal hyper-parameters (with early stopping on the validation set)
+            base_params = {'objective': 'reg:squarederror', 'n_estimators': 1000, 'base_score': y_train.mean()}
+            tasks += search_tasks(name + '/search', fit['search_result'], matrices[model_type], y_train.values, params_grid,
+                                  base_params, search, after=previous_search[model_type],
+                                  checkpoint=checkpoint_path(fit, 'search'))
+            previous_search[model_type] = [name + '/search']
+            tasks.append(task(name + '/save_search', save_search_results, (fit,), cores=0, after=[name + '/search']))
+
+            # Train on whole training set (including validation set) and predict test set
+            tasks.append(task(name + '/refit', refit_model, (fit, refit_cores), cores=refit_cores,
+                              after=[name + '/save_search'], priority=2))
 
             # Calculate SHAP values on test set
             if area in ['CE', 'Nordic', 'GB']:
                 if model_type=='_full':
-                    shap_vals = shap.TreeExplainer(model).shap_values(X_test)
-                    np.save(res_folder + 'shap_values_gtb{}.npy'.format(model_type), shap_vals)
-                
-                    shap_interact_vals = shap.TreeExplainer(model).shap_interaction_values(X_test)
-                    np.save(res_folder + 'shap_interaction_values_gtb{}.npy'.format(model_type), shap_interact_vals)
-
-            # Prediction on test set
-            y_pred['gtb{}'.format(model_type)] = model.predict(X_test) 
-            print(model_type[1:], 'Best performance: {}'.format(r2_score(y_test, y_pred['gtb{}'.format(model_type)])))   
+                    tasks.append(task(name + '/shap', save_shap_values, (fit,), after=[name + '/refit'], priority=1))
+                    tasks.append(task(name + '/shap_interactions', save_shap_values, (fit, True), after=[name + '/refit'],
+                                      priority=1))
 
         # Save prediction
-        y_pred.to_hdf(res_folder+'y_pred.h5',key='df')
+        name = '{}/{}/predictions'.format(area, target)
+        tasks.append(task(name, save_predictions, (fits, res_folder), cores=0, after=[fit['name'] + '/refit' for fit in fits]))
         
+        # Compare R2 scores and predictions with reference run
+        if compact_dtypes:
+            reference_res_folder = './results/model_fit/{}/version_{}/target_{}/'.format(area,reference_data_version, target)
+            reference_data_folder = './data/{}/version_{}/'.format(area,reference_data_version)
+            tasks.append(task('{}/{}/compact_report'.format(area, target), prediction_report,
+                              (compact_report, area, target, y_test, res_folder, reference_res_folder, reference_data_folder,
+                               split_scheme), cores=0, after=[name]))
+
+run_tasks(tasks, n_cores)
+
+if compact_dtypes:
+    save_compact_report(compact_report, compact_report_file)
 
 print("Execution time [h]: {}".format((time.time() - start_time)/3600.))
 
@@ -0,0 +1,68 @@
+import os
+import pandas as pd 
+
+import sys
+
+sys.path.append('./')
+
+from utils.entsoe_processing import open_contribution_store
+from utils.documentation_plots import render_figures, plot_contribution, plot_omitted_contributions, plot_histograms
+
+# Documentation figures of the data download and preparation (stages 3 and 4).
+# The figures are rendered from the persisted data and can be (re-)created at any time 
+# after these stages. Figures with unchanged input data are skipped.
+
+if __name__ == '__main__':
+
+    # Areas inlcuding "country" areas
+    areas = ['CE', 'GB', 'Nordic', 'SE', 'CH', 'DE']
+
+    # Path to ENTSO-E downloaded data
+    entsoe_data_folder = '../../External_data/ENTSO-E/' 
+
+    # Path for generated features and tragets
+    folder = './data/{}/'
+
+    # Documentation of data download 
+    doc_folder = folder + 'documentation_of_data_download/'
+
+    # Number of parallel rendering processes
+    n_jobs = 4
+
+
+    for area in areas:
+    
+        print('########### ', area, ' ###########')
+    
+        if not os.path.exists(doc_folder.format(area)):
+            os.makedirs(doc_folder.format(area))
+    
+        figures = []
+    
+        # Download results of all (region, variable)-contributions
+        contrib_store_file = entsoe_data_folder + 'region_contributions_{}.npy'.format(area)
+        if os.path.exists(contrib_store_file):
+            contrib_info, contrib_matrix, contrib_index, contrib_columns = open_contribution_store(contrib_store_file)
+            for contrib_name in contrib_info.index:
+                position = contrib_columns.get_loc(contrib_name)
+                contribution = pd.Series(contrib_matrix[:,position], index=contrib_index, name=contrib_name)
+                figures.append((plot_contribution, contribution, doc_folder.format(area)+contrib_name+'.png', {}))
+    
+        # Omitted contributions during aggregation
+        omitted_contribs_file = doc_folder.format(area)+'omitted_contributions.csv'
+        if os.path.exists(omitted_contribs_file):
+            omitted_contribs = pd.read_csv(omitted_contribs_file)
+            figures.append((plot_omitted_contributions, omitted_contribs,
+                            doc_folder.format(area) + 'omitted_contributions_relative_to_variable_mean.svg',
+                            {'ratio':'ratio_var'}))
+            figures.append((plot_omitted_contributions, omitted_contribs,
+                            doc_folder.format(area) + 'omitted_contributions_relative_to_mean_load.svg',
+                            {'ratio':'ratio_load'}))
+    
+        # Distribution of raw input data
+        raw_input_file = folder.format(area) + 'raw_input_data.h5'
+        if os.path.exists(raw_input_file):
+            raw_input_data = pd.read_hdf(raw_input_file)
+            figures.append((plot_histograms, raw_input_data, doc_folder.format(area)+'raw_data_histograms.svg', {}))
+    
+        render_figures(figures, doc_folder.format(area) + 'figure_hashes.json', n_jobs=n_jobs)
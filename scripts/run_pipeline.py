@@ -0,0 +1,122 @@
+import sys
+
+sys.path.append('./')
+
+from utils.pipeline import run_pipeline
+
+# Runs the stages 2-6 of the pipeline (from the repository directory) and reruns only the stages
+# and units (areas, targets) whose script, parameters or input content changed since their outputs
+# were created. Intermediate HDF files are fingerprinted by their data (or only the columns a stage
+# depends on), so that rewriting a file with unchanged content does not trigger downstream stages.
+# The lineage of every output is saved next to it as <output>.lineage.json.
+# Usage: python scripts/run_pipeline.py [stage names] [--force]
+
+# Stage parameters
+# (passed to the stage scripts, which use their own defaults if run standalone)
+smooth_windows =  {'CE': 60, 'GB': 60, 'Nordic':30}
+lookup_windows =   {'CE': 60, 'GB': 60, 'Nordic':30}
+targets = ['f_integral', 'f_ext', 'f_msd', 'f_rocof']
+data_version = '2021-07-01'
+
+# Hyper-parameter search of the model fit ('grid' or successive 'halving' over the same grid)
+search = 'grid'
+
+# Core budget of the model fit (cores in total and of each refit) and whether an interrupted 
+# model fit resumes from its checkpoints (these do not change the results and do not trigger a refit)
+n_cores = 25
+refit_cores = 8
+resume = True
+
+# Compact dtypes for intermediate data (float32, small integers, categoricals) with reports in 
+# ./results/compact_dtypes/. The reports of stages 2-5 only show the deviation caused by the cast 
+# when a data set is saved, not how it propagates into the downstream features and indicators. 
+# For the effect on the model fit, run the compact dtypes with another data version and set the 
+# version prepared with float64 data as reference (None: only the R2 scores are reported).
+compact_dtypes = False
+reference_data_version = None
+
+# Areas with frequency recordings and "country" areas that share their outputs
+tso_names = {'GB': 'Nationalgrid', 'CE': 'TransnetBW', 'Nordic': 'Fingrid' }
+country_areas = {'GB': [], 'CE': ['DE', 'CH'], 'Nordic': ['SE']}
+areas = ['CE', 'GB', 'Nordic', 'SE', 'CH', 'DE']
+
+# Train-test data and model fit results
+version_folder = './data/{area}/version_{data_version}/'
+result_folder = './results/model_fit/{area}/version_{data_version}/target_{target}/'
+split_scheme = 'random'
+split_files = ['split_table.npy', 'split_table.json', 'split_index.npy', 'split_{}.npz'.format(split_scheme)]
+
+stages = [
+    {
+        'name': '2_stability_indicator_prep',
+        'script': 'scripts/2_stability_indicator_prep.py',
+        'units': [{'area': area, 'tso': tso} for area, tso in tso_names.items()],
+        'selection': {'areas': ['{area}']},
+        'parameters': lambda unit: {'smooth_windows': {unit['area']: smooth_windows[unit['area']]},
+                                    'lookup_windows': {unit['area']: lookup_windows[unit['area']]},
+                                    'skip_hour_with_nan': True, 'compact_dtypes': compact_dtypes},
+        'inputs': ['../Frequency_data_base/*_cleansed/{tso}/*.zip',
+                   'utils/stability_indicators.py', 'utils/compact_dtypes.py'],
+        # (outputs of the "country" areas are copies of the outputs of their synchronous area)
+        'outputs': lambda unit: ['./data/{}/outputs.h5'.format(area) for area in [unit['area']] + country_areas[unit['area']]]
+    },
+    {
+        # All areas are processed together as each monthly ENTSO-E file is read once for all areas
+        # (the aggregation only depends on the hours with missing outputs)
+        'name': '3_entsoe_data_prep',
+        'script': 'scripts/3_entsoe_data_prep.py',
+        'units': [{}],
+        'parameters': {'final_nan_ratio_limit': 0.37, 'compact_dtypes': compact_dtypes},
+        'inputs': ['../../External_data/ENTSO-E/*.csv',
+                   'utils/entsoe_processing.py', 'utils/compact_dtypes.py',
+                   *[{'path': './data/{}/outputs.h5'.format(area), 'nan_mask': True} for area in areas]],
+        'outputs': ['./data/{}/raw_input_data.h5'.format(area) for area in areas]
+    },
+    {
+        'name': '4_external_feature_prep',
+        'script': 'scripts/4_external_feature_prep.py',
+        'units': [{'area': area} for area in areas],
+        'selection': {'areas': ['{area}']},
+        'parameters': {'compact_dtypes': compact_dtypes},
+        'inputs': [{'path': './data/{area}/raw_input_data.h5'}, 'utils/feature_engine.py', 'utils/compact_dtypes.py'],
+        'outputs': ['./data/{area}/input_actual.h5', './data/{area}/input_forecast.h5']
+    },
+    {
+        'name': '5_train_test_split',
+        'script': 'scripts/5_train_test_split.py',
+        'units': [{'area': area, 'data_version': data_version} for area in areas],
+        'selection': {'areas': ['{area}']},
+        'parameters': {'targets': targets, 'data_version': data_version, 'compact_dtypes': compact_dtypes},
+        'inputs': [{'path': './data/{area}/input_actual.h5'}, {'path': './data/{area}/input_forecast.h5'},
+                   {'path': './data/{area}/outputs.h5', 'columns': targets},
+                   'utils/split_store.py', 'utils/compact_dtypes.py'],
+        'outputs': [version_folder + file for file in split_files]
+    },
+    {
+        # The targets of an area are fitted in one run as one task graph on the core budget (sharing the
+        # search matrices of the area), but only the targets whose inputs changed are refitted
+        'name': '6_model_fit',
+        'script': 'scripts/6_model_fit.py',
+        'units': [{'area': area, 'data_version': data_version} for area in areas],
+        'parts': [{'target': target} for target in targets],
+        'selection': lambda unit, parts: {'areas': [unit['area']], 'targets': [part['target'] for part in parts]},
+        'parameters': {'data_version': data_version, 'compact_dtypes': compact_dtypes,
+                       'reference_data_version': reference_data_version, 'split_scheme': split_scheme,
+                       'search': search},
+        'run_parameters': {'n_cores': n_cores, 'refit_cores': refit_cores, 'resume': resume},
+        # (only the features and the fitted target of the joined table, so that a change of another 
+        # target does not refit this one)
+        'inputs': [{'path': version_folder, 'format': 'split_table', 'columns': 'full'},
+                   {'path': version_folder, 'format': 'split_table', 'columns': ['{target}']},
+                   version_folder + 'split_{}.npz'.format(split_scheme),
+                   'utils/split_store.py', 'utils/compact_dtypes.py', 'utils/hyper_parameter_search.py',
+                   'utils/job_scheduler.py', 'utils/model_fit.py', 'utils/checkpoints.py'],
+        'outputs': [result_folder + 'y_pred.h5']
+    }
+]
+
+
+if __name__ == '__main__':
+
+    selected_stages = [arg for arg in sys.argv[1:] if arg!='--force'] or None
+    run_pipeline(stages, './.pipeline_fingerprints.json', selected_stages, force='--force' in sys.argv)
@@ -0,0 +1,106 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import pickle
+import hashlib
+import threading
+
+
+def fingerprint(*items):
+
+    # SHA-1 hash of data frames, arrays and JSON-serializable items (e.g. parameters) that identifies
+    # the inputs of a checkpoint
+    sha1 = hashlib.sha1()
+    for item in items:
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            names = item.columns if isinstance(item, pd.DataFrame) else [item.name]
+            sha1.update(json.dumps([str(name) for name in names]).encode())
+            sha1.update(pd.util.hash_pandas_object(item, index=True).values.tobytes())
+        elif isinstance(item, np.ndarray):
+            sha1.update(json.dumps([item.shape, str(item.dtype)]).encode())
+            sha1.update(np.ascontiguousarray(item).tobytes())
+        else:
+            sha1.update(json.dumps(item, sort_keys=True, default=str).encode())
+
+    return sha1.hexdigest()
+
+
+def save_checkpoint(checkpoint_file, key, data):
+
+    # Atomic write (temporary file and rename) of a checkpoint with the key of its inputs
+    if not os.path.exists(os.path.dirname(checkpoint_file)):
+        os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    with open(checkpoint_file + '.tmp', 'wb') as f:
+        pickle.dump({'key': key, 'data': data}, f)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file, key):
+
+    # Data of a checkpoint, None if there is no (complete) checkpoint for the given key
+    if not os.path.exists(checkpoint_file):
+        return None
+    try:
+        with open(checkpoint_file, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except (EOFError, pickle.UnpicklingError):
+        print('Checkpoint {} could not be read'.format(checkpoint_file))
+        return None
+
+    return checkpoint['data'] if checkpoint['key']==key else None
+
+
+def save_array(array_file, array):
+
+    # Atomic write of a numpy array
+    with open(array_file + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(array_file + '.tmp', array_file)
+
+
+def open_journal(journal_file, key):
+
+    # Journal of completed work items (e.g. CV fits of single configurations) as JSON lines, which are
+    # appended as soon as an item is completed. The first line holds the key of the inputs, a journal
+    # of other inputs is started anew. Incomplete lines (from an interruption) are ignored.
+    records = {}
+    valid = False
+    if os.path.exists(journal_file):
+        with open(journal_file) as f:
+            content = f.read()
+        lines = content.split('\n')
+        try:
+            valid = json.loads(lines[0])['key']==key
+        except (ValueError, KeyError, TypeError):
+            valid = False
+        if valid:
+            for line in lines[1:]:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record['item']] = record['data']
+            if not content.endswith('\n'):
+                with open(journal_file, 'a') as f:
+                    f.write('\n')
+
+    if not valid:
+        if not os.path.exists(os.path.dirname(journal_file)):
+            os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+        with open(journal_file + '.tmp', 'w') as f:
+            f.write(json.dumps({'key': key}) + '\n')
+        os.replace(journal_file + '.tmp', journal_file)
+
+    return {'file': journal_file, 'records': records, 'lock': threading.Lock()}
+
+
+def append_journal(journal, item, data):
+
+    line = json.dumps({'item': item, 'data': data})
+    with journal['lock']:
+        with open(journal['file'], 'a') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        journal['records'][item] = data
@@ -0,0 +1,73 @@
+import pandas as pd
+import numpy as np
+import os
+
+
+# Calendar features that fit into small integers
+calendar_columns = ['month', 'weekday', 'hour']
+
+
+def compact_frame(data):
+
+    # Memory-lean version of a data set: float32 for measured quantities, small integers for
+    # calendar features and categoricals for text columns (e.g. region and variable names)
+    data = data.copy()
+    for column in data.columns:
+        if pd.api.types.is_float_dtype(data[column]):
+            data[column] = data[column].astype(np.float32)
+        elif pd.api.types.is_integer_dtype(data[column]) and column in calendar_columns:
+            data[column] = pd.to_numeric(data[column], downcast='integer')
+        elif data[column].dtype==object:
+            data[column] = data[column].astype('category')
+
+    return data
+
+
+def _max(values):
+
+    values = values[~np.isnan(values)]
+
+    return values.max() if values.size else 0.
+
+
+def compact_report(stage, area, name, original, compact):
+
+    # Memory saved by the compact dtypes and maximum deviation of the numeric values
+    # (only the deviation of the cast itself, not of the features and indicators calculated from it)
+    numeric = original.select_dtypes('number').columns
+    original_values = original.loc[:,numeric].values.astype(float)
+    deviation = np.abs(compact.loc[:,numeric].values.astype(float) - original_values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_deviation = np.where(original_values!=0, deviation / np.abs(original_values), np.nan)
+
+    memory = original.memory_usage(deep=True).sum()
+    compact_memory = compact.memory_usage(deep=True).sum()
+
+    return {'stage': stage, 'area': area, 'name': name,
+            'memory_mb': memory / 2**20, 'compact_memory_mb': compact_memory / 2**20,
+            'memory_saved_ratio': 1 - compact_memory / memory,
+            'max_abs_deviation': _max(deviation.ravel()),
+            'max_rel_deviation': _max(relative_deviation.ravel())}
+
+
+def save_compact_report(report, report_file):
+
+    # Append report rows of a stage to the report file
+    report = pd.DataFrame(report)
+    if not os.path.exists(os.path.dirname(report_file)):
+        os.makedirs(os.path.dirname(report_file))
+    report.to_csv(report_file, mode='a', header=not os.path.exists(report_file), index=False)
+
+    print(report.to_string(index=False))
+
+
+def prepare_for_saving(data, compact_dtypes, report, stage, area, name):
+
+    # Compact version of a data set before it is saved (if the compact-dtype mode is on)
+    if not compact_dtypes:
+        return data
+
+    compact = compact_frame(data)
+    report.append(compact_report(stage, area, name, data, compact))
+
+    return compact
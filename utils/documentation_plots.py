@@ -0,0 +1,102 @@
+import pandas as pd
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use('agg')
+from matplotlib import pyplot as plt
+
+
+def plot_contribution(contribution, figure_file):
+
+    # Document the download results of a (region, variable)-contribution
+    contribution.plot()
+    plt.savefig(figure_file, dpi=200,  bbox_inches='tight')
+    plt.close()
+
+
+def plot_omitted_contributions(omitted_contribs, figure_file, ratio='ratio_var'):
+
+    # Omitted contributions (during aggregation) relative to the variable mean or the total mean load
+    fig,ax=plt.subplots(figsize=(9,4))
+    data = omitted_contribs.pivot(index='variable', columns='region', values=ratio)
+    data = data.loc[:,data.sum()>0.001]
+    if ratio=='ratio_load':
+        data = data.drop(index=['prices_day_ahead'])
+    data.plot.bar(stacked=True, legend=False, cmap='tab20', ax=ax)
+    plt.xlabel('')
+    if ratio=='ratio_load':
+        plt.ylabel('Mean omission / total mean load')
+    else:
+        plt.ylabel('Mean omission / variable mean')
+    plt.legend(bbox_to_anchor=(0.8,0.5,0.5,0.5))
+    plt.savefig(figure_file, bbox_inches='tight')
+    plt.close()
+
+
+def plot_histograms(data, figure_file):
+
+    # Inspection of data distribution as histograms
+    fig,ax=plt.subplots(figsize=(20,20))
+    data.hist(log=True,ax=ax, bins=100)
+    plt.tight_layout()
+    plt.savefig(figure_file, bbox_inches='tight')
+    plt.close()
+
+
+def _figure_hash(plot_function, data, kwargs):
+
+    # Hash of the input data (values, index and column names) and the plot settings
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps([plot_function.__name__, kwargs], sort_keys=True).encode())
+    if isinstance(data, pd.DataFrame):
+        sha1.update(json.dumps([str(column) for column in data.columns]).encode())
+    else:
+        sha1.update(str(data.name).encode())
+    sha1.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+
+    return sha1.hexdigest()
+
+
+def _render_figure(plot_function, data, figure_file, kwargs):
+
+    try:
+        plot_function(data, figure_file, **kwargs)
+        return True
+    except Exception as error:
+        print('Figure {} could not be rendered: {}'.format(figure_file, error))
+        plt.close('all')
+        return False
+
+
+def render_figures(figures, manifest_file, n_jobs=4):
+
+    # Render documentation figures from persisted data. Each figure is given as tuple
+    # (plot_function, data, figure_file, kwargs). Figures whose input data and plot settings
+    # did not change since the last rendering (hashes in manifest file) are skipped.
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    else:
+        manifest = {}
+
+    pending = []
+    for plot_function, data, figure_file, kwargs in figures:
+        figure_hash = _figure_hash(plot_function, data, kwargs)
+        if manifest.get(os.path.basename(figure_file))==figure_hash and os.path.exists(figure_file):
+            continue
+        pending.append((plot_function, data, figure_file, kwargs, figure_hash))
+
+    print('Rendering {} of {} figures'.format(len(pending), len(figures)))
+
+    # Render figures in parallel and update manifest with successfully rendered figures
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(_render_figure, plot_function, data, figure_file, kwargs)
+                   for plot_function, data, figure_file, kwargs, figure_hash in pending]
+        for (plot_function, data, figure_file, kwargs, figure_hash), future in zip(pending, futures):
+            if future.result():
+                manifest[os.path.basename(figure_file)] = figure_hash
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=4)
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt 
+import os
+import json
+import hashlib
 
 def drop_non_existent(data):
     
@@ -25,9 +27,12 @@ def resample_time_series(data, time_resolution):
 
     return data
 
-def save_region_variable_contrib(contribution, region, path_to_hdf_file, path_to_doc_folder):
+def contrib_name(region, variable):
     
-    contrib_info = pd.DataFrame(columns=['region','variable','nan_ratio','number_neg_vals', 'mean'])
+    return '{}_{}'.format(region.replace('-', '_').replace(' ','_').replace('(','_').replace(')','_'), variable)
+
+
+def prepare_region_variable_contrib(contribution, region):
     
     # Apply a final correction to the GB data 
     # (gen_other and gen_biomass were apparently split into two data series at some point)
@@ -36,47 +41,301 @@ def save_region_variable_contrib(contribution, region, path_to_hdf_file, path_to
         contribution.loc[:, 'gen_other'] = corrected_gen_other
         contribution.loc[:, 'gen_biomass'] = 0
     
-    # Drop non-existent columns
-    contribution = drop_non_existent(contribution)
-    
-    # Save (region, variable)-contributions to seperate files and document download results
-    if not contribution.empty:
+    # Label columns as (region, variable)-contributions
+    # (non-existent contributions are kept here and excluded via the contribution statistics of the store, 
+    # as they might exist in data added later)
+    contribution = contribution.sort_index()
+    contribution.columns = pd.MultiIndex.from_product([[region], contribution.columns])
         
-        contribution.sort_index(inplace=True)
+    return contribution
+
+
+def _contrib_statistics(values):
+    
+    # Statistics of contribution values (rows x contributions) that can be updated incrementally
+    valid = ~np.isnan(values)
+    
+    return {'n_valid': valid.sum(axis=0),
+            'sum': np.where(valid, values, 0).sum(axis=0),
+            'n_neg': (values<0).sum(axis=0),
+            'n_nonzero': (valid & (values!=0)).sum(axis=0)}
+
+
+def _contrib_info(metadata):
+    
+    # Contribution info (nan-ratio etc.) of all existing contributions, i.e. contributions
+    # that are not completely missing or zero
+    statistics = pd.DataFrame(metadata['statistics'], index=metadata['columns'])
+    statistics = statistics[statistics.n_nonzero>0]
+    
+    contrib_info = pd.DataFrame(index=statistics.index)
+    contrib_info['region'] = pd.Categorical([metadata['regions'][name] for name in statistics.index])
+    contrib_info['variable'] = pd.Categorical([metadata['variables'][name] for name in statistics.index])
+    contrib_info['nan_ratio'] = (metadata['n_samples'] - statistics.n_valid) / metadata['n_samples']
+    contrib_info['number_neg_vals'] = statistics.n_neg
+    contrib_info['mean'] = statistics.loc[:,'sum'] / statistics.n_valid
+    
+    return contrib_info
+
+
+def update_contribution_store(store_file, contributions, time_index):
+    
+    # Store all (region, variable)-contributions of an area as one dense time x contribution float32 
+    # matrix (.npy, column-major so that each contribution is a contiguous block) and the time index, 
+    # column names and contribution statistics as metadata file (.json). 
+    # The rows of the given contributions (e.g. new or changed months) replace the stored rows and the 
+    # statistics are updated only by the difference between the replaced and the new rows.
+    if len(time_index)==0:
+        raise ValueError('Empty time index for contribution store {}'.format(store_file))
+    names = [contrib_name(region, variable) for region, variable in contributions.columns]
+    
+    # Time resolution from the frequency of the time index (which may have a single time step)
+    time_resolution = pd.Timedelta(time_index.freq) if time_index.freq is not None else time_index[1] - time_index[0]
+    
+    metadata = None
+    if os.path.exists(store_file) and os.path.exists(store_file[:-4] + '.json'):
+        with open(store_file[:-4] + '.json') as f:
+            metadata = json.load(f)
+        if (pd.Timestamp(metadata['start'])!=time_index[0] or 
+            pd.Timedelta(metadata['time_resolution'])!=time_resolution or 
+            metadata['n_samples']>len(time_index)):
+            print('Time index of {} changed, rebuilding store'.format(store_file))
+            metadata = None
+    if metadata is None:
+        metadata = {'start': time_index[0].isoformat(),
+                    'time_resolution': time_resolution.isoformat(),
+                    'n_samples': 0, 'columns': [], 'regions': {}, 'variables': {},
+                    'statistics': {key: [] for key in ['n_valid', 'sum', 'n_neg', 'n_nonzero']}}
+    
+    # Extend matrix by new time steps (at the end) or new contributions
+    new_names = [name for name in names if name not in metadata['columns']]
+    if metadata['n_samples']<len(time_index) or new_names:
+        matrix = np.full((len(time_index), len(metadata['columns']) + len(new_names)), np.nan,
+                         dtype=np.float32, order='F')
+        if metadata['n_samples']>0 and metadata['columns']:
+            matrix[:metadata['n_samples'], :len(metadata['columns'])] = np.load(store_file, mmap_mode='r')
+        with open(store_file + '.tmp', 'wb') as f:
+            np.save(f, matrix)
+        os.replace(store_file + '.tmp', store_file)
+        del matrix
         
-        for var in contribution.columns:
-            
-            contrib_name = '{}_{}'.format(region.replace('-', '_').replace(' ','_').replace('(','_').replace(')','_'),
-                                        var)
-            contribution.loc[:,var].to_hdf(path_to_hdf_file, key=contrib_name, mode='a', complevel=9)
-            
-            # Extract infos, e.g. nan-ratio
-            contrib_info.loc[contrib_name,'nan_ratio'] = contribution.loc[:,var].isnull().sum()/contribution.shape[0]
-            contrib_info.loc[contrib_name, 'variable'] = var
-            contrib_info.loc[contrib_name, 'region'] = region
-            contrib_info.loc[contrib_name, 'number_neg_vals'] = (contribution.loc[:,var]<0).sum()
-            contrib_info.loc[contrib_name, 'mean'] = contribution.loc[:,var].mean()
-
-            # Document the download results
-            contribution.loc[:,var].plot()
-            plt.savefig(path_to_doc_folder+contrib_name+'.png', dpi=200,  bbox_inches='tight')
-            plt.close()
+        for (region, variable), name in zip(contributions.columns, names):
+            if name in new_names:
+                metadata['columns'].append(name)
+                metadata['regions'][name] = region
+                metadata['variables'][name] = variable
+                for key in metadata['statistics']:
+                    metadata['statistics'][key].append(0)
+        metadata['n_samples'] = len(time_index)
+    
+    # Replace rows and update statistics
+    matrix = np.load(store_file, mmap_mode='r+')
+    rows = time_index.get_indexer(contributions.index)
+    if (rows<0).any():
+        print('Contributions outside of the store time index are ignored')
+        contributions, rows = contributions[rows>=0], rows[rows>=0]
+    positions = pd.Index(metadata['columns']).get_indexer(names)
+    
+    old_values = matrix[np.ix_(rows, positions)].astype(float)
+    new_values = contributions.values.astype(np.float32)
+    matrix[np.ix_(rows, positions)] = new_values
+    matrix.flush()
+    del matrix
+    
+    old_statistics = _contrib_statistics(old_values)
+    new_statistics = _contrib_statistics(new_values.astype(float))
+    for key, statistic in metadata['statistics'].items():
+        statistic = np.array(statistic, dtype=float if key=='sum' else np.int64)
+        statistic[positions] += new_statistics[key] - old_statistics[key]
+        metadata['statistics'][key] = statistic.tolist()
+    
+    with open(store_file[:-4] + '.json.tmp', 'w') as f:
+        json.dump(metadata, f)
+    os.replace(store_file[:-4] + '.json.tmp', store_file[:-4] + '.json')
+
+
+def open_contribution_store(store_file):
+    
+    # Contribution info, memory-mapped contribution matrix, its time index and column names (nothing is read yet)
+    with open(store_file[:-4] + '.json') as f:
+        metadata = json.load(f)
+    matrix = np.load(store_file, mmap_mode='r')
+    
+    contrib_info = _contrib_info(metadata)
+    time_index = pd.date_range(pd.Timestamp(metadata['start']), periods=metadata['n_samples'],
+                               freq=pd.Timedelta(metadata['time_resolution']))
+    
+    return contrib_info, matrix, time_index, pd.Index(metadata['columns'])
+
+
+def read_contribution_store(store_file, contrib_names=None):
+    
+    # Only the columns of the requested contributions are read from the memory-mapped matrix
+    contrib_info, matrix, time_index, columns = open_contribution_store(store_file)
+    if contrib_names is None:
+        contrib_names = contrib_info.index
+    positions = columns.get_indexer(contrib_names)
+    if (positions<0).any():
+        print('Contributions not in store: ', list(pd.Index(contrib_names)[positions<0]))
+        positions = positions[positions>=0]
+    
+    return pd.DataFrame(matrix[:,positions], index=time_index, columns=columns[positions])
+
+
+def _source_fingerprint(file, check_hash=False):
+    
+    # Size and modification time (and optionally the SHA-1 hash) of a source file
+    stat = os.stat(file)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    
+    if check_hash:
+        sha1 = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                sha1.update(block)
+        fingerprint['hash'] = sha1.hexdigest()
         
-    return contrib_info
+    return fingerprint
 
 
-def extract_region_variable_contrib(entsoe_data_folder, file_type, region, variable_name, pivot_column_name, column_rename_dict, 
-                            start_time, end_time,  time_resolution='1H'):
+def _save_columns(data, cache_file, fingerprint):
+    
+    # Save a parsed file column-wise (datetimes as int64, categoricals as codes and categories)
+    columns, arrays = [], {}
+    for i, (name, column) in enumerate(data.items()):
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            kind = 'category'
+            arrays['codes_{}'.format(i)] = column.cat.codes.values
+            arrays['categories_{}'.format(i)] = np.array(column.cat.categories, dtype=str)
+        elif pd.api.types.is_datetime64_dtype(column):
+            kind = 'datetime'
+            arrays['values_{}'.format(i)] = column.values.astype(np.int64)
+        else:
+            kind = 'values'
+            arrays['values_{}'.format(i)] = column.values
+        columns.append([name, kind])
+    
+    metadata = json.dumps({'fingerprint': fingerprint, 'columns': columns})
+    with open(cache_file + '.tmp', 'wb') as f:
+        np.savez(f, metadata=metadata, **arrays)
+    os.replace(cache_file + '.tmp', cache_file)
+
+
+def _load_columns(cache, metadata):
+    
+    data = {}
+    for i, (name, kind) in enumerate(metadata['columns']):
+        if kind=='category':
+            data[name] = pd.Categorical.from_codes(cache['codes_{}'.format(i)], cache['categories_{}'.format(i)])
+        elif kind=='datetime':
+            data[name] = pd.to_datetime(cache['values_{}'.format(i)])
+        else:
+            data[name] = cache['values_{}'.format(i)]
+    
+    return pd.DataFrame(data, columns=[name for name, kind in metadata['columns']])
+
+
+def read_entsoe_csv(file, cache_folder=None, check_hash=False):
+    
+    # Read a monthly ENTSO-E file with parsed DateTime column and categorical text columns
+    # (e.g. AreaName, ProductionType). If a cache folder is given, the parsed file is stored there 
+    # column-wise and reused as long as size and modification time (and hash) of the file are unchanged.
+    # Object columns with other than string values are kept as they are and the file is not cached.
+    if cache_folder is not None:
+        cache_file = cache_folder + os.path.basename(file)[:-4] + '.npz'
+        fingerprint = _source_fingerprint(file, check_hash)
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cache:
+                metadata = json.loads(str(cache['metadata']))
+                if metadata['fingerprint']==fingerprint:
+                    return _load_columns(cache, metadata)
+    
+    data = pd.read_csv(file, sep='\t', encoding = "utf-8", header=0,
+                        index_col=False)
+    data['DateTime'] = pd.to_datetime(data.DateTime)
+    for name in data.columns[data.dtypes==object]:
+        if pd.api.types.infer_dtype(data[name], skipna=True) in ['string', 'empty']:
+            data[name] = data[name].astype('category')
+    
+    if cache_folder is not None and (data.dtypes==object).any():
+        print('Not cached (mixed-type columns {}): {}'.format(list(data.columns[data.dtypes==object]), file))
+    elif cache_folder is not None:
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+        _save_columns(data, cache_file, fingerprint)
+    
+    return data
 
-    time_index = pd.date_range(start_time,end_time,freq=time_resolution)
+
+def read_ingest_manifest(manifest_file, settings, end_time, store_files):
+    
+    # Manifest of the ingested monthly files (a new one is started if the processing settings changed,
+    # the time range was shortened or a contribution store is missing, while an extended time range 
+    # only adds months)
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        stores_exist = all(os.path.exists(file) and os.path.exists(file[:-4] + '.json') for file in store_files)
+        if manifest['settings']==settings and pd.Timestamp(manifest['end'])<=end_time and stores_exist:
+            manifest['end'] = str(end_time)
+            return manifest
+        if not stores_exist:
+            print('Contribution stores are missing, all files are ingested again')
+        else:
+            print('Processing settings or time range changed, all files are ingested again')
+    
+    return {'settings': settings, 'end': str(end_time), 'files': {}}
 
 
+def write_ingest_manifest(manifest, manifest_file):
+    
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+def pending_monthly_files(entsoe_data_folder, file_type, start_time, end_time, time_resolution, manifest):
+    
+    # Monthly files of a file type that are new, changed or were only partly ingested (time range 
+    # of their month not fully covered) with the time range to ingest and their manifest entry
+    pending = []
+    for date_index in pd.date_range(start_time,end_time,freq='M'):
         
-    print('--------- ',region, ' ----------')            
-    contribution = pd.DataFrame(columns=column_rename_dict.values(),
-                                index=time_index, data=np.nan)
+        file = entsoe_data_folder + '{}_{:02d}_{}.csv'.format(date_index.year,
+                                                                    date_index.month,
+                                                                    file_type)
+        first = max(start_time, date_index.normalize().replace(day=1))
+        last = min(end_time, date_index.normalize() + pd.Timedelta('1D') - time_resolution)
+        
+        entry = {'fingerprint': _source_fingerprint(file), 'first': str(first), 'last': str(last)}
+        if manifest['files'].get(os.path.basename(file))!=entry:
+            pending.append((file, first, last, entry))
+    
+    return pending
+
 
+# Regions whose data is reported under different area names over time
+# (BZN 'DE' refers to two different zones that split on Oct 2018 and thus have to be merged)
+merged_area_names = {'DE-LU BZN': ['DE-AT-LU BZN', 'DE-LU BZN']}
+
+
+def extract_region_variable_contribs(entsoe_data_folder, file_type, regions, variable_name, pivot_column_name, 
+                                     column_rename_dict, start_time, end_time,  time_resolution='1H', cache_folder=None):
+    
+    time_index = pd.date_range(start_time,end_time,freq=time_resolution)
+    
+    print('--------- ', ', '.join(regions), ' ----------')
+    contributions = {region: pd.DataFrame(columns=column_rename_dict.values(), index=time_index, data=np.nan)
+                     for region in regions}
+    
+    # Map area names in the files to the requested regions
+    area_name_map = {}
+    for region in regions:
+        for area_name in merged_area_names.get(region, [region]):
+            area_name_map[area_name] = region
+    
     # Iterate over files containing different months and years
+    # (each file is read once for all regions)
     for date_index in pd.date_range(start_time,end_time,freq='M'):
 
         file = entsoe_data_folder + '{}_{:02d}_{}.csv'.format(date_index.year,
@@ -85,46 +344,57 @@ def extract_region_variable_contrib(entsoe_data_folder, file_type, region, varia
         
         print('\r'+file, end="\r", flush=True)
         
-        # Read data
-        data = pd.read_csv(file, sep='\t', encoding = "utf-8", header=0,
-                            index_col=False)
-
-        # Select rows with correct region code and region type 
-        # (BZN 'DE' refers to two different zones that split on Oct 2018
-        # and thus have to be merged )
-        if region=='DE-LU BZN':
-            data = data[(data.AreaName=='DE-AT-LU BZN') |  (data.AreaName=='DE-LU BZN')]
-        else:
-            data = data[(data.AreaName==region)]
-
-        # Extract data and setup datetime index
+        # Read data and select rows with requested region codes and region types 
+        data = read_entsoe_csv(file, cache_folder)
+        data = data[data.AreaName.isin(area_name_map.keys())]
         if pivot_column_name:
-            data = data.pivot(index='DateTime', columns=pivot_column_name,
-                                values=variable_name)
-            data.index= pd.to_datetime(data.index)
-        else:
-            data.index= pd.to_datetime(data.DateTime)
-            data = data.loc[:,[variable_name]]
+            data = data.assign(**{pivot_column_name: data.loc[:,pivot_column_name].astype(object)})
+        
+        for region, region_data in data.groupby(data.AreaName.astype(object).map(area_name_map)):
+            
+            # Extract data and setup datetime index
+            if pivot_column_name:
+                region_data = region_data.pivot(index='DateTime', columns=pivot_column_name,
+                                                values=variable_name)
+            else:
+                region_data = region_data.set_index('DateTime').loc[:,[variable_name]]
+            
+            # Rename columns and resample index
+            region_data = region_data.rename(columns=column_rename_dict)
+            region_data = resample_time_series(region_data, time_resolution)
+            
+            # Update region contribution
+            contributions[region].update(region_data)
 
-        # Rename columns and resample index
-        data = data.rename(columns=column_rename_dict)
-        data = resample_time_series(data, time_resolution)
+    print('\n')
+    
+    return contributions
 
-        # Update region contribution
-        contribution.update(data)
 
-    print('\n')
-        
-            
-    return contribution
+def extract_region_variable_contrib(entsoe_data_folder, file_type, region, variable_name, pivot_column_name, column_rename_dict, 
+                            start_time, end_time,  time_resolution='1H', cache_folder=None):
+
+    contributions = extract_region_variable_contribs(entsoe_data_folder, file_type, [region], variable_name,
+                                                     pivot_column_name, column_rename_dict, start_time, end_time,
+                                                     time_resolution, cache_folder)
+    
+    return contributions[region]
 
 
-def calc_mean_bzn_load(entsoe_data_folder, region, start_time, end_time):
-        
-    print('--------- ',region, ' ----------') 
+# Load data used for the weighting of bidding zones
+# (We use German country data for DE_AT_LU/ DE_LU bidding zones as we need a unique weight
+# for the price time series)
+load_area_names = {'DE-LU BZN': 'DE CTY'}
+
+
+def calc_mean_bzn_loads(entsoe_data_folder, regions, start_time, end_time, cache_folder=None):
+    
+    print('--------- ',', '.join(regions), ' ----------') 
     
-    data_points = 0
-    load_sum =0
+    load_area_map = {region: load_area_names.get(region, region) for region in regions}
+    
+    data_points = pd.Series(0, index=list(set(load_area_map.values())))
+    load_sum = pd.Series(0., index=data_points.index)
         
     # Iterate over files containing different months and years 
     for date_index in pd.date_range(start_time,end_time,freq='M'):
@@ -135,43 +405,47 @@ def calc_mean_bzn_load(entsoe_data_folder, region, start_time, end_time):
         
         print('\r'+file, end="\r", flush=True)
 
-        # Read load data
-        data = pd.read_csv(file, sep='\t', encoding = "utf-8", header=0,
-                            index_col=False)
+        # Read load data of all requested areas
+        data = read_entsoe_csv(file, cache_folder)
+        data = data[data.AreaName.isin(data_points.index)]
         
-        # Extract load data 
-        # (We use German country data for DE_AT_LU/ DE_LU bidding zones as we need a unique weight
-        # for the price time series)
-        if region=='DE-LU BZN':
-            data = data[data.AreaName=='DE CTY']
-        else:
-            data = data[data.AreaName==region]
-
-        # Add up load sum
-        data = data.loc[:,'TotalLoadValue']
-        if data.notnull().any():
-            data_points += data.notnull().sum()
-            load_sum += data.sum()
+        # Add up load sums and number of data points per area 
+        load_stats = data.groupby(data.AreaName.astype(object)).TotalLoadValue.agg(['sum','count'])
+        load_stats = load_stats.reindex(data_points.index, fill_value=0)
+        data_points += load_stats.loc[:,'count']
+        load_sum += load_stats.loc[:,'sum']
     
     print('\n')
         
-    # Calculate mean load for region
-    if data_points!=0:
-        mean_bzn_load = load_sum / data_points
-    else:
-        mean_bzn_load=None
+    # Calculate mean load for regions (NaN for regions without data)
+    mean_load = load_sum[data_points!=0] / data_points[data_points!=0]
+    mean_bzn_load = mean_load.reindex(list(load_area_map.values()))
+    mean_bzn_load.index = list(load_area_map.keys())
         
     return mean_bzn_load
 
 
-def aggregate_external_features(region_contrib_path,mean_bzn_load, contrib_info, output_data ,start_time, end_time, time_resolution='1H',
+def calc_mean_bzn_load(entsoe_data_folder, region, start_time, end_time, cache_folder=None):
+    
+    mean_bzn_load = calc_mean_bzn_loads(entsoe_data_folder, [region], start_time, end_time, cache_folder)
+    
+    if mean_bzn_load.notnull().any():
+        return mean_bzn_load.loc[region]
+    else:
+        return None
+
+
+def aggregate_external_features(contrib_store_file, mean_bzn_load, output_data ,start_time, end_time, time_resolution='1H',
                                 final_nan_ratio_limit = 0.3):
     
     time_index = pd.date_range(start_time,end_time,freq=time_resolution)
     length = len(time_index)
     
-    # Initialize final input data and omitted contributions (for documentation)
-    raw_input_data = pd.DataFrame(index=time_index)
+    # Open contribution store (contributions are read column-wise from the memory-mapped matrix)
+    contrib_info, contrib_matrix, contrib_index, contrib_columns = open_contribution_store(contrib_store_file)
+    
+    # Initialize final input data (running sums per variable) and omitted contributions (for documentation)
+    raw_input_sums = {}
     omitted_contribs = pd.DataFrame(columns=['region','variable','mean', 'ratio_var', 'ratio_load'] ) 
     
     # Initialize weighted averaging of prices
@@ -183,6 +457,9 @@ def aggregate_external_features(region_contrib_path,mean_bzn_load, contrib_info,
     invalid_outputs.index = invalid_outputs.index.tz_convert('UTC').tz_localize(None)
     final_nan_ratio = invalid_outputs.sum() / output_data.shape[0]
     potential_nan_ratio = 1
+    
+    # Running bitmap of invalid rows in final data set (invalid outputs or NaN in any added contribution)
+    invalid_rows = invalid_outputs.reindex(time_index, fill_value=False).values.astype(bool)
      
     # Add (region,variable)-contributions with increasing nan-ratio until 
     # final nan ratio exceeds threshold 
@@ -192,8 +469,8 @@ def aggregate_external_features(region_contrib_path,mean_bzn_load, contrib_info,
         if final_nan_ratio < final_nan_ratio_limit:
             
             # Read contribution data
-            data = pd.read_hdf(region_contrib_path, key=contrib_name)  
-            potential_input_data = raw_input_data.copy()
+            position = contrib_columns.get_loc(contrib_name)
+            data = pd.Series(contrib_matrix[:,position].astype(float), index=contrib_index)
             
             # Choose weights for averaging or summation
             if contrib.variable=='prices_day_ahead':
@@ -201,19 +478,19 @@ def aggregate_external_features(region_contrib_path,mean_bzn_load, contrib_info,
             else:
                 weight = 1
                 
-            # Add potential contribution
-            if contrib.variable not in potential_input_data.columns:
-                potential_input_data.loc[:,contrib.variable] = data*weight
-            else:
-                potential_input_data.loc[:,contrib.variable] += data*weight
-            
-            # Calculate (potential) nan-ratio in final data set
-            potential_nan_ratio = (potential_input_data.isnull().any(axis=1) | invalid_outputs).sum() / length
+            # Calculate (potential) nan-ratio in final data set by only adding the NaNs of the new contribution
+            contribution = (data*weight).reindex(time_index).values
+            potential_invalid_rows = invalid_rows | np.isnan(contribution)
+            potential_nan_ratio = potential_invalid_rows.sum() / length
             
         # If potential (new) nan-ratio low enough, add contribution to final data 
         if potential_nan_ratio < final_nan_ratio_limit:
             
-            raw_input_data = potential_input_data.copy()  
+            if contrib.variable not in raw_input_sums:
+                raw_input_sums[contrib.variable] = contribution
+            else:
+                raw_input_sums[contrib.variable] += contribution
+            invalid_rows = potential_invalid_rows
             final_nan_ratio = potential_nan_ratio   
             
             if contrib.variable=='prices_day_ahead':
@@ -227,14 +504,15 @@ def aggregate_external_features(region_contrib_path,mean_bzn_load, contrib_info,
             omitted_contribs.loc[contrib_name] = contrib.loc[['region', 'variable','mean']]
             
             # Save relative omitted mean contribution 
-            if contrib.variable in raw_input_data:
-                raw_input_mean = raw_input_data.loc[:,contrib.variable].mean()
+            if contrib.variable in raw_input_sums:
+                raw_input_mean = pd.Series(raw_input_sums[contrib.variable]).mean()
                 omitted_contribs.loc[contrib_name, 'ratio_var'] = contrib.loc['mean'] / raw_input_mean
-            omitted_contribs.loc[contrib_name, 'ratio_load'] = contrib.loc['mean'] / raw_input_data.load.mean()
+            omitted_contribs.loc[contrib_name, 'ratio_load'] = contrib.loc['mean'] / pd.Series(raw_input_sums['load']).mean()
 
             print('Omitted: ', contrib_name, ' | potential final nu. of points: {}'.format(length-int(potential_nan_ratio*length)))
 
     # Apply weighted average to prices
+    raw_input_data = pd.DataFrame(raw_input_sums, index=time_index)
     raw_input_data.loc[:,'prices_day_ahead'] = raw_input_data.prices_day_ahead / total_mean_load
     
-    return raw_input_data, omitted_contribs
\ No newline at end of file
+    return raw_input_data, omitted_contribs
@@ -0,0 +1,192 @@
+import pandas as pd
+import numpy as np
+import json
+import hashlib
+from fnmatch import fnmatch
+
+
+# Day-ahead available and actual (ex-post) features from ENTSO-E data
+actual_inputs = ['load', 'gen_biomass', 'gen_lignite', 'gen_coal_gas', 'gen_gas',
+                 'gen_hard_coal', 'gen_oil', 'gen_oil_shale', 'gen_fossil_peat',
+                 'gen_geothermal', 'gen_pumped_hydro', 'gen_run_off_hydro',
+                 'gen_reservoir_hydro', 'gen_marine', 'gen_nuclear', 'gen_other_renew',
+                 'gen_solar', 'gen_waste', 'gen_wind_off', 'gen_wind_on', 'gen_other']
+
+forecast_inputs = ['load_day_ahead', 'scheduled_gen_total','prices_day_ahead',
+                   'solar_day_ahead','wind_off_day_ahead', 'wind_on_day_ahead']
+
+
+# Engineered features as (name, frame, operation, dependencies) in the order of evaluation.
+# Operations: 'calendar' (month, weekday or hour of the local time), 'sum' (sum of the available
+# dependencies, NaN as zero), 'difference' (first minus second dependency) and 'diff' (change to the
+# previous hour). Dependencies can be patterns ('gen_*') of the input columns. A name with '*' declares
+# one feature for each matching input column. Features with missing dependencies are omitted and
+# features of frame None are only intermediate results.
+feature_specs = [
+
+    # Time
+    ('month', 'forecast', 'calendar', []),
+    ('weekday', 'forecast', 'calendar', []),
+    ('hour', 'forecast', 'calendar', []),
+
+    # Total generation
+    ('total_gen', 'actual', 'sum', ['gen_*']),
+
+    # Inertia proxy - Sum of all synchronous generation
+    ('variable_renew_gen', None, 'sum', ['gen_solar', 'gen_wind_off', 'gen_wind_on']),
+    ('synchronous_gen', 'actual', 'difference', ['total_gen', 'variable_renew_gen']),
+
+    # Ramps of load and total generation
+    ('load_ramp_day_ahead', 'forecast', 'diff', ['load_day_ahead']),
+    ('load_ramp', 'actual', 'diff', ['load']),
+    ('total_gen_ramp_day_ahead', 'forecast', 'diff', ['scheduled_gen_total']),
+    ('total_gen_ramp', 'actual', 'diff', ['total_gen']),
+
+    # Ramps of generaton types
+    ('wind_off_ramp_day_ahead', 'forecast', 'diff', ['wind_off_day_ahead']),
+    ('wind_on_ramp_day_ahead', 'forecast', 'diff', ['wind_on_day_ahead']),
+    ('solar_ramp_day_ahead', 'forecast', 'diff', ['solar_day_ahead']),
+    ('*_ramp', 'actual', 'diff', ['gen_*']),
+
+    # Price Ramps
+    ('price_ramp_day_ahead', 'forecast', 'diff', ['prices_day_ahead']),
+
+    # Forecast errors
+    ('forecast_error_wind_on', 'actual', 'difference', ['wind_on_day_ahead', 'gen_wind_on']),
+    ('forecast_error_wind_off', 'actual', 'difference', ['wind_off_day_ahead', 'gen_wind_off']),
+    ('forecast_error_wind_off_ramp', 'actual', 'difference', ['wind_off_ramp_day_ahead', 'wind_off_ramp']),
+    ('forecast_error_total_gen', 'actual', 'difference', ['scheduled_gen_total', 'total_gen']),
+    ('forecast_error_load', 'actual', 'difference', ['load_day_ahead', 'load']),
+    ('forecast_error_load_ramp', 'actual', 'difference', ['load_ramp_day_ahead', 'load_ramp']),
+    ('forecast_error_total_gen_ramp', 'actual', 'difference', ['total_gen_ramp_day_ahead', 'total_gen_ramp']),
+    ('forecast_error_wind_on_ramp', 'actual', 'difference', ['wind_on_ramp_day_ahead', 'wind_on_ramp']),
+    ('forecast_error_solar_ramp', 'actual', 'difference', ['solar_ramp_day_ahead', 'solar_ramp']),
+    ('forecast_error_solar', 'actual', 'difference', ['solar_day_ahead', 'gen_solar']),
+]
+
+
+def compile_features(specs, input_columns):
+
+    # Resolve the feature declarations for the available input columns into an evaluation plan
+    # with column positions. The plan also contains the number of preceding hours (lookback) that
+    # the 'diff' features need to evaluate a block of new hours.
+    inputs = {'actual': [column for column in input_columns if column in actual_inputs],
+              'forecast': [column for column in input_columns if column in forecast_inputs]}
+    input_columns = inputs['actual'] + inputs['forecast']
+    columns = list(input_columns)
+    depth = {column: 0 for column in columns}
+
+    features = []
+    for name, frame, operation, dependencies in specs:
+
+        # Expand patterns (over input columns only)
+        if '*' in name:
+            pattern = dependencies[0]
+            prefix, suffix = pattern.split('*')
+            expanded = [(name.replace('*', column[len(prefix):len(column)-len(suffix)]), [column])
+                        for column in input_columns if fnmatch(column, pattern)]
+        else:
+            resolved = []
+            for dependency in dependencies:
+                if '*' in dependency:
+                    resolved += [column for column in input_columns if fnmatch(column, dependency)]
+                else:
+                    resolved.append(dependency)
+            expanded = [(name, resolved)]
+
+        for feature, feature_dependencies in expanded:
+            available = [dependency for dependency in feature_dependencies if dependency in depth]
+            if operation=='sum':
+                if not available:
+                    continue
+                feature_dependencies = available
+            elif len(available) < len(feature_dependencies):
+                continue
+
+            columns.append(feature)
+            depth[feature] = max([depth[dependency] for dependency in feature_dependencies], default=0) + (operation=='diff')
+            features.append([feature, frame, operation, [columns.index(dependency) for dependency in feature_dependencies]])
+
+    frames = {frame: inputs[frame] + [feature[0] for feature in features if feature[1]==frame]
+              for frame in ['actual', 'forecast']}
+
+    return {'inputs': input_columns, 'columns': columns, 'features': features,
+            'frames': frames, 'lookback': max(depth.values(), default=0)}
+
+
+def plan_hash(plan):
+
+    return hashlib.sha1(json.dumps(plan, sort_keys=True).encode()).hexdigest()
+
+
+def evaluate_features(plan, values, index, lookback=0):
+
+    # Evaluate all features of the plan on a block of hours (input values as array in the order of
+    # plan['inputs'], local time index). The first lookback rows are only used for the ramps of the
+    # following rows and are not returned.
+    n_inputs = len(plan['inputs'])
+    block = np.empty((values.shape[0], len(plan['columns'])), order='F')
+    block[:,:n_inputs] = values
+
+    features = {}
+    for name, frame, operation, dependencies in plan['features']:
+        j = plan['columns'].index(name)
+        if operation=='calendar':
+            calendar = np.asarray(getattr(index, name), dtype=np.int64)
+            block[:,j] = calendar
+        elif operation=='sum':
+            block[:,j] = np.nansum(block[:,dependencies], axis=1)
+        elif operation=='difference':
+            np.subtract(block[:,dependencies[0]], block[:,dependencies[1]], out=block[:,j])
+        elif operation=='diff':
+            block[:1,j] = np.nan
+            np.subtract(block[1:,dependencies[0]], block[:-1,dependencies[0]], out=block[1:,j])
+        else:
+            raise ValueError('Unknown feature operation {}'.format(operation))
+
+        if frame is not None:
+            features[name] = calendar[lookback:] if operation=='calendar' else block[lookback:,j]
+
+    return features
+
+
+def evaluate_feature_frames(plan, data, tz, start=0):
+
+    # Actual and forecast input frames with engineered features for the hours data.iloc[start:]
+    # (including the preceding hours for the ramps) converted to the local timezone tz
+    first = max(start - plan['lookback'], 0)
+    block = data.iloc[first:]
+    index = block.index.tz_convert(tz)
+    features = evaluate_features(plan, block.loc[:,plan['inputs']].to_numpy(dtype=np.float64), index, start-first)
+
+    frames = []
+    for frame in ['actual', 'forecast']:
+        frame_data = {column: block[column].values[start-first:] if column in plan['inputs'] else features[column]
+                      for column in plan['frames'][frame]}
+        frames.append(pd.DataFrame(frame_data, index=index[start-first:], columns=plan['frames'][frame]))
+
+    return frames
+
+
+def first_changed_hour(plan, data, input_actual, input_forecast):
+
+    # Position of the first hour in data for which the previously saved frames have to be updated
+    # (new hours or changed input values), 0 if the saved frames do not fit the plan
+    if list(input_actual.columns)!=plan['frames']['actual'] or list(input_forecast.columns)!=plan['frames']['forecast']:
+        return 0
+    n_saved = input_actual.shape[0]
+    if n_saved > data.shape[0] or not input_forecast.index.equals(input_actual.index):
+        return 0
+    if not data.index[:n_saved].equals(input_actual.index.tz_convert(data.index.tz)):
+        return 0
+
+    changed = np.zeros(n_saved, dtype=bool)
+    for frame, saved in [('actual', input_actual), ('forecast', input_forecast)]:
+        for column in plan['frames'][frame]:
+            if column not in plan['inputs']:
+                continue
+            saved_values = saved[column].values
+            values = data[column].values[:n_saved].astype(saved_values.dtype)
+            changed |= ~((values==saved_values) | (np.isnan(values) & np.isnan(saved_values)))
+
+    return changed.argmax() if changed.any() else n_saved
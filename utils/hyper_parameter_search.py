@@ -0,0 +1,280 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import time
+import xgboost as xgb
+from sklearn.model_selection import KFold, ParameterGrid
+from sklearn.metrics import r2_score
+
+from utils.job_scheduler import task
+from utils.checkpoints import fingerprint, save_checkpoint, load_checkpoint, open_journal, append_journal
+
+
+def _training_matrix(X):
+
+    # Feature matrix for the histogram tree construction. With QuantileDMatrix (xgboost>=1.7) the
+    # features are quantized once and each fit reuses the bins. The pinned xgboost 1.4.2 has no
+    # QuantileDMatrix: its hist method quantizes the DMatrix again in every xgb.train call, so only
+    # the construction of the DMatrix is shared.
+    if hasattr(xgb, 'QuantileDMatrix'):
+        return xgb.QuantileDMatrix(X)
+
+    return xgb.DMatrix(X)
+
+
+def search_matrices(X, train_rows, val_rows, cv=5, random_state=42):
+
+    # Matrices of the training set (train_rows of the feature values X), the validation set for
+    # early stopping and (on demand) of the CV folds (see _training_matrix for what is shared with
+    # the installed xgboost). The matrices only depend on the features and are shared by all
+    # parameter configurations and targets (labels are set per target).
+    matrices = {'X': X, 'train_rows': np.asarray(train_rows), 'cv': cv, 'random_state': random_state,
+                'y': None, 'folds': {}, 'labelled': [],
+                'fingerprint': fingerprint(X, np.asarray(train_rows), np.asarray(val_rows), cv, random_state)}
+    matrices['train'] = _add_matrix(matrices, matrices['train_rows'], _training_matrix(X[train_rows]))
+    matrices['val'] = _add_matrix(matrices, np.asarray(val_rows), xgb.DMatrix(X[val_rows]))
+
+    return matrices
+
+
+def _add_matrix(matrices, rows, matrix):
+
+    matrices['labelled'].append((rows, matrix))
+    if matrices['y'] is not None:
+        matrix.set_label(matrices['y'][rows])
+
+    return matrix
+
+
+def set_search_labels(matrices, y):
+
+    # Target values (of all rows of X) for the following searches
+    matrices['y'] = np.asarray(y, dtype=float)
+    for rows, matrix in matrices['labelled']:
+        matrix.set_label(matrices['y'][rows])
+
+
+def _fold_matrices(matrices, n_samples):
+
+    # Train and test matrices of the CV folds on n_samples rows of the training set
+    # (a random subsample of a fixed seed, so that the folds are the same for all targets)
+    n_train = len(matrices['train_rows'])
+    key = min(n_samples, n_train)
+    if key not in matrices['folds']:
+        rows = matrices['train_rows']
+        if key < n_train:
+            subsample = np.random.RandomState(matrices['random_state']).choice(n_train, key, replace=False)
+            rows = rows[np.sort(subsample)]
+        folds = []
+        for fold_train, fold_test in KFold(matrices['cv']).split(rows):
+            folds.append((_add_matrix(matrices, rows[fold_train], _training_matrix(matrices['X'][rows[fold_train]])),
+                          _add_matrix(matrices, rows[fold_test], xgb.DMatrix(matrices['X'][rows[fold_test]]))))
+        matrices['folds'][key] = folds
+
+    return matrices['folds'][key]
+
+
+def _booster_params(params, base_params):
+
+    # Native xgboost parameters (the scikit-learn names are accepted as aliases)
+    booster_params = {key: value for key, value in base_params.items() if key!='n_estimators'}
+    booster_params.update(params)
+    booster_params.update({'tree_method': 'hist', 'nthread': 1, 'verbosity': 0})
+
+    return booster_params
+
+
+def _fit(params, base_params, dtrain, dval, early_stopping_rounds):
+
+    return xgb.train(_booster_params(params, base_params), dtrain, num_boost_round=base_params['n_estimators'],
+                     evals=[(dval, 'validation')], early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+
+
+def _cv_scores(params, base_params, folds, dval, early_stopping_rounds):
+
+    # R2 scores, fit and score times on the CV folds (with early stopping on the validation set)
+    scores, fit_times, score_times = [], [], []
+    for dtrain, dtest in folds:
+        start_time = time.time()
+        booster = _fit(params, base_params, dtrain, dval, early_stopping_rounds)
+        fit_times.append(time.time() - start_time)
+
+        start_time = time.time()
+        prediction = booster.predict(dtest, iteration_range=(0, booster.best_iteration + 1))
+        scores.append(r2_score(dtest.get_label(), prediction))
+        score_times.append(time.time() - start_time)
+
+    return scores, fit_times, score_times
+
+
+def _search_schedule(n_candidates, max_resources, cv, search, factor):
+
+    # Number of iterations and samples of the first iteration (as in scikit-learn's successive halving
+    # with min_resources='exhaust', so that the last iteration uses (almost) all samples)
+    if search=='grid':
+        return 1, max_resources
+    if search=='halving':
+        n_required_iterations = 1 + int(np.floor(np.log(n_candidates) / np.log(factor)))
+        min_resources = max(2 * cv, max_resources // factor ** (n_required_iterations - 1))
+        n_possible_iterations = 1 + int(np.floor(np.log(max_resources // min_resources) / np.log(factor)))
+        return min(n_required_iterations, n_possible_iterations), min_resources
+
+    raise ValueError('Unknown hyper-parameter search {}'.format(search))
+
+
+def search_tasks(name, search_result, matrices, y, params_grid, base_params, search='grid', after=(), factor=3,
+                 early_stopping_rounds=20, checkpoint=None):
+
+    # Tasks of an exhaustive grid search or successive halving over the same grid on the shared
+    # matrices with labels y (set when the search starts, after the given tasks). Successive halving
+    # evaluates all configurations on a small subsample of the training set and only continues with
+    # the best third on three times more samples (the boosting rounds adapt via early stopping on the
+    # validation set). Each configuration is a single-core task that fits all CV folds. The final task
+    # (named name) fills search_result with the CV results (in the format of scikit-learn's search CV
+    # results), the best parameters (including n_estimators from early stopping of the best
+    # configuration on the whole training set) and the resources of each iteration.
+    # With a checkpoint path, the CV scores of each configuration are journaled as soon as they are
+    # completed (checkpoint.jsonl) and the search result is saved (checkpoint.pkl), so that an
+    # interrupted search resumes with the missing configurations and a completed one is not repeated.
+    candidates = list(ParameterGrid(params_grid))
+    max_resources = len(matrices['train_rows'])
+    n_iterations, min_resources = _search_schedule(len(candidates), max_resources, matrices['cv'], search, factor)
+    state = {'matrices': matrices, 'y': y, 'base_params': base_params, 'search': search, 'factor': factor,
+             'early_stopping_rounds': early_stopping_rounds, 'candidates': candidates, 'n_iterations': n_iterations,
+             'min_resources': min_resources, 'max_resources': max_resources, 'cv_results': [],
+             'n_candidates': [], 'n_resources': [], 'result': search_result, 'checkpoint': checkpoint,
+             'key': fingerprint(matrices['fingerprint'], np.asarray(y, dtype=float), params_grid, base_params, search,
+                                factor, early_stopping_rounds)}
+
+    return [task(name + '/start', _start_search, (name, state), cores=0, after=after)]
+
+
+def _start_search(name, state):
+
+    # Completed search or CV scores of an interrupted search
+    state['journal'] = None
+    if state['checkpoint'] is not None:
+        search_result = load_checkpoint(state['checkpoint'] + '.pkl', state['key'])
+        if search_result is not None:
+            state['result'].update(search_result)
+            return [task(name, print, ('{}: restored from checkpoint'.format(name),), cores=0)]
+        state['journal'] = open_journal(state['checkpoint'] + '.jsonl', state['key'])
+        if state['journal']['records']:
+            print('{}: resuming with {} completed CV fits'.format(name, len(state['journal']['records'])))
+
+    set_search_labels(state['matrices'], state['y'])
+    state['start_time'] = time.time()
+
+    return _iteration_tasks(name, state)
+
+
+def _iteration_tasks(name, state):
+
+    iteration = len(state['n_candidates'])
+    resources = min(state['min_resources'] * state['factor'] ** iteration, state['max_resources'])
+    folds = _fold_matrices(state['matrices'], resources)
+    state['n_candidates'].append(len(state['candidates']))
+    state['n_resources'].append(resources)
+    state['scores'] = [None] * len(state['candidates'])
+    print('{}: fitting {} folds for each of {} candidates on {} samples'.format(name, len(folds),
+                                                                                  len(state['candidates']), resources))
+
+    tasks = [task('{}/iter{}/{}'.format(name, iteration, i), _candidate_scores, (state, i, folds, resources))
+             for i in range(len(state['candidates']))]
+    tasks.append(task('{}/iter{}'.format(name, iteration), _select_candidates, (name, state), cores=0,
+                      after=[candidate_task['name'] for candidate_task in tasks]))
+
+    return tasks
+
+
+def _candidate_scores(state, i, folds, resources):
+
+    item = json.dumps([resources, state['candidates'][i]], sort_keys=True)
+    if state['journal'] is not None and item in state['journal']['records']:
+        state['scores'][i] = state['journal']['records'][item]
+        return
+
+    state['scores'][i] = _cv_scores(state['candidates'][i], state['base_params'], folds, state['matrices']['val'],
+                                    state['early_stopping_rounds'])
+    if state['journal'] is not None:
+        append_journal(state['journal'], item, state['scores'][i])
+
+
+def _select_candidates(name, state):
+
+    iteration, resources = len(state['n_candidates']) - 1, state['n_resources'][-1]
+    iteration_results = []
+    for params, (scores, fit_times, score_times) in zip(state['candidates'], state['scores']):
+        result = {'mean_fit_time': np.mean(fit_times), 'std_fit_time': np.std(fit_times),
+                  'mean_score_time': np.mean(score_times), 'std_score_time': np.std(score_times)}
+        result.update({'param_' + param_name: value for param_name, value in params.items()})
+        result['params'] = params
+        result.update({'split{}_test_score'.format(i): score for i, score in enumerate(scores)})
+        result.update({'mean_test_score': np.mean(scores), 'std_test_score': np.std(scores)})
+        if state['search']=='halving':
+            result.update({'iter': iteration, 'n_resources': resources})
+        iteration_results.append(result)
+    state['cv_results'] += iteration_results
+
+    # Keep the best configurations for the next iteration
+    order = np.argsort([-result['mean_test_score'] for result in iteration_results], kind='stable')
+    if iteration + 1 < state['n_iterations']:
+        state['candidates'] = [state['candidates'][i] for i in order[:int(np.ceil(len(order) / state['factor']))]]
+        return _iteration_tasks(name, state)
+
+    state['best'] = iteration_results[order[0]]
+
+    return [task(name, _best_rounds, (state,))]
+
+
+def _best_rounds(state):
+
+    # Number of boosting rounds of the best configuration with early stopping on the validation set
+    best = state['best']
+    booster = _fit(best['params'], state['base_params'], state['matrices']['train'], state['matrices']['val'],
+                   state['early_stopping_rounds'])
+    best_params = dict(state['base_params'])
+    best_params.update(best['params'])
+    best_params.update({'n_estimators': booster.best_iteration + 1, 'tree_method': 'hist'})
+
+    cv_results = pd.DataFrame(state['cv_results'])
+    cv_results['rank_test_score'] = cv_results.mean_test_score.rank(ascending=False, method='min').astype(int)
+
+    state['result'].update({'cv_results': cv_results, 'best_params': best_params, 'best_score': best['mean_test_score'],
+                            'n_candidates': state['n_candidates'], 'n_resources': state['n_resources'],
+                            'max_resources': state['max_resources'], 'n_splits': state['matrices']['cv'],
+                            'fit_time': time.time() - state['start_time']})
+    if state['checkpoint'] is not None:
+        save_checkpoint(state['checkpoint'] + '.pkl', state['key'], state['result'])
+
+
+def search_suffix(search):
+
+    # Suffix of the result files (the files of the exhaustive grid search keep their names)
+    return '' if search=='grid' else '_' + search
+
+
+def halving_search_report(search_result, params_grid, grid_cv_results_file):
+
+    # Cost of the successive halving relative to the exhaustive grid and (if the grid results exist)
+    # the CV score of the chosen parameters in the exhaustive grid compared to the best grid score
+    n_candidates, n_resources = np.array(search_result['n_candidates']), np.array(search_result['n_resources'])
+    report = {'n_iterations': len(n_candidates), 'n_candidates': n_candidates[0],
+              'n_fits': n_candidates.sum() * search_result['n_splits'],
+              'relative_resources': (n_candidates * n_resources).sum() / (n_candidates[0] * search_result['max_resources']),
+              'fit_time_s': search_result['fit_time'], 'best_score': search_result['best_score']}
+    report.update({'best_' + name: search_result['best_params'][name] for name in params_grid})
+
+    if os.path.exists(grid_cv_results_file):
+        grid_cv_results = pd.read_csv(grid_cv_results_file)
+        chosen = np.ones(grid_cv_results.shape[0], dtype=bool)
+        for name in params_grid:
+            chosen &= np.isclose(grid_cv_results['param_' + name].astype(float), float(search_result['best_params'][name]))
+        if chosen.any():
+            report['grid_score'] = grid_cv_results.loc[chosen, 'mean_test_score'].iloc[0]
+            report['grid_rank'] = grid_cv_results.loc[chosen, 'rank_test_score'].iloc[0]
+            report['grid_best_score'] = grid_cv_results.mean_test_score.max()
+            report['grid_score_gap'] = report['grid_best_score'] - report['grid_score']
+
+    return report
@@ -0,0 +1,87 @@
+import time
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def task(name, function, args=(), cores=1, after=(), priority=0):
+
+    # Task of a task graph: function(*args) runs on the given number of cores once all tasks
+    # named in after are finished (tasks with 0 cores are short bookkeeping steps)
+    return {'name': name, 'function': function, 'args': args, 'cores': cores, 'after': list(after),
+            'priority': priority}
+
+
+def _is_task_list(result):
+
+    return isinstance(result, list) and all(isinstance(item, dict) and 'function' in item for item in result)
+
+
+def _rank(task):
+
+    return (task['cores']>0, -task['priority'])
+
+
+def run_tasks(tasks, n_cores):
+
+    # Run a task graph on a budget of n_cores in threads (the numeric work, e.g. xgboost and numpy,
+    # releases the GIL). Ready tasks are started (bookkeeping tasks with 0 cores first, then in order
+    # of priority and of creation) as long as their cores are free. A ready task that does not fit yet
+    # blocks the tasks of lower priority, so that large tasks (e.g. multi-threaded refits) are not
+    # starved by small ones. A task can extend the graph by returning a list of new tasks (e.g. the
+    # next iteration of a search). Returns the results of all tasks.
+    results = {}
+    n_waiting = {}
+    dependents = {}
+    ready = []
+    order = itertools.count()
+
+    def add(new_tasks):
+        for new_task in new_tasks:
+            missing = [name for name in new_task['after'] if name not in results]
+            n_waiting[new_task['name']] = len(missing)
+            for name in missing:
+                dependents.setdefault(name, []).append(new_task)
+            if not missing:
+                heapq.heappush(ready, (_rank(new_task), next(order), new_task))
+
+    add(tasks)
+    running = {}
+    free_cores = n_cores
+    busy_core_seconds = 0.
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=n_cores + 8) as executor:
+        while ready or running:
+
+            # Start ready tasks on the free cores
+            while ready and min(ready[0][2]['cores'], n_cores) <= free_cores:
+                next_task = heapq.heappop(ready)[2]
+                cores = min(next_task['cores'], n_cores)
+                free_cores -= cores
+                future = executor.submit(next_task['function'], *next_task['args'])
+                running[future] = (next_task, cores, time.time())
+
+            # Collect finished tasks, release their dependents and add the tasks they created
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                finished_task, cores, task_start_time = running.pop(future)
+                free_cores += cores
+                busy_core_seconds += cores * (time.time() - task_start_time)
+                result = future.result()
+                results[finished_task['name']] = result
+                for dependent in dependents.pop(finished_task['name'], []):
+                    n_waiting[dependent['name']] -= 1
+                    if n_waiting[dependent['name']]==0:
+                        heapq.heappush(ready, (_rank(dependent), next(order), dependent))
+                if _is_task_list(result):
+                    add(result)
+
+    if dependents:
+        raise ValueError('Tasks wait for unknown tasks: {}'.format(sorted(dependents)[:10]))
+
+    wall_time = time.time() - start_time
+    print('Ran {} tasks in {:.0f} s on {} cores (core utilization {:.0%})'.format(
+        len(results), wall_time, n_cores, busy_core_seconds / max(wall_time * n_cores, 1e-9)))
+
+    return results
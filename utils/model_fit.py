@@ -0,0 +1,134 @@
+import pandas as pd
+import os
+import shap
+import xgboost as xgb
+from sklearn.metrics import r2_score
+
+from utils.hyper_parameter_search import search_suffix, halving_search_report
+from utils.split_store import open_split_table, read_split_rows, split_frame
+from utils.checkpoints import fingerprint, save_checkpoint, load_checkpoint, save_array
+
+
+# A fit is the dict of a (area, target, model type)-job with its name, result folder, model type,
+# the train and test data, the search settings (search, params_grid) and the results of its tasks.
+# Completed tasks are checkpointed in the checkpoints folder of the result folder and are not
+# repeated if their inputs did not change.
+
+
+def checkpoint_path(fit, task_name):
+
+    return fit['res_folder'] + 'checkpoints/{}_gtb{}{}'.format(task_name, search_suffix(fit['search']), fit['model_type'])
+
+
+def save_search_results(fit):
+
+    res_folder, model_type, search = fit['res_folder'], fit['model_type'], fit['search']
+
+    # Save CV results
+    fit['search_result']['cv_results'].to_csv(res_folder+'cv_results_gtb{}{}.csv'.format(search_suffix(search), model_type))
+
+    # Save best params (including n_estimators from early stopping on validation set)
+    pd.DataFrame(fit['search_result']['best_params'], index=[0]).to_csv(
+        res_folder+'cv_best_params_gtb{}{}.csv'.format(search_suffix(search), model_type))
+
+    # Compare successive halving with the exhaustive grid search
+    if search=='halving':
+        report = halving_search_report(fit['search_result'], fit['params_grid'],
+                                       res_folder+'cv_results_gtb{}.csv'.format(model_type))
+        pd.DataFrame(report, index=[0]).to_csv(res_folder+'search_report_gtb{}{}.csv'.format(search_suffix(search), model_type))
+        print('{}\n{}'.format(fit['name'], pd.Series(report).to_string()))
+
+
+def refit_model(fit, n_jobs):
+
+    # Gradient boosting regression best model evaluation on test set
+    best_params = pd.read_csv(fit['res_folder']+'cv_best_params_gtb{}{}.csv'.format(search_suffix(fit['search']), fit['model_type']),
+                              usecols = list(fit['params_grid'].keys()) + ['n_estimators', 'base_score', 'objective',
+                                                                           'tree_method'])
+    best_params = best_params.to_dict('records')[0]
+
+    # Refitted model and prediction of an earlier run (with the same library versions, as the pickled
+    # model is only valid for the xgboost version that saved it)
+    fit['refit_key'] = fingerprint(best_params, fit['X_train'], fit['y_train'], fit['X_test'],
+                                   xgb.__version__, shap.__version__)
+    refit = load_checkpoint(checkpoint_path(fit, 'refit') + '.pkl', fit['refit_key'])
+    if refit is not None:
+        fit['model'], fit['prediction'] = refit['model'], refit['prediction']
+        print('{} Refit restored from checkpoint'.format(fit['name']))
+        return
+
+    best_params['n_jobs'] = n_jobs
+    print('{} Number of opt. boosting rounds: {}'.format(fit['name'], best_params['n_estimators']))
+
+    # Train on whole training set (including validation set)
+    model = xgb.XGBRegressor(**best_params)
+    model.fit(fit['X_train'], fit['y_train'])
+    fit['model'] = model
+
+    # Prediction on test set
+    fit['prediction'] = model.predict(fit['X_test'])
+    save_checkpoint(checkpoint_path(fit, 'refit') + '.pkl', fit['refit_key'], {'model': model, 'prediction': fit['prediction']})
+    print('{} Best performance: {}'.format(fit['name'], r2_score(fit['y_test'], fit['prediction'])))
+
+
+def save_shap_values(fit, interactions=False):
+
+    # SHAP (interaction) values on test set (unless saved for the same model before)
+    name = 'shap_interaction_values' if interactions else 'shap_values'
+    shap_file = fit['res_folder'] + '{}_gtb{}.npy'.format(name, fit['model_type'])
+    key = fingerprint(fit['refit_key'], interactions, xgb.__version__, shap.__version__)
+    if load_checkpoint(checkpoint_path(fit, name) + '.pkl', key)==shap_file and os.path.exists(shap_file):
+        print('{} SHAP values restored from checkpoint'.format(fit['name']))
+        return
+
+    # (shap calculates the values with the booster's own threads, which are limited to the single
+    # core of the task instead of the cores of the refit)
+    fit['model'].get_booster().set_param('nthread', 1)
+    if interactions:
+        shap_vals = shap.TreeExplainer(fit['model']).shap_interaction_values(fit['X_test'])
+    else:
+        shap_vals = shap.TreeExplainer(fit['model']).shap_values(fit['X_test'])
+    save_array(shap_file, shap_vals)
+    save_checkpoint(checkpoint_path(fit, name) + '.pkl', key, shap_file)
+
+
+def save_predictions(fits, res_folder):
+
+    # Predictions of the benchmark models and of the gradient boosting models (one fit per model type)
+    # of a target
+    fit = fits[0]
+    y_train, y_test = fit['y_train'], fit['y_test']
+    y_pred = pd.DataFrame(index=y_test.index)
+
+    # Daily profile prediction
+    daily_profile = y_train.groupby(fit['X_train'].index.time).mean()
+    y_pred['daily_profile'] = [daily_profile[time] for time in fit['X_test'].index.time]
+
+    # Mean predictor
+    y_pred['mean_predictor'] = y_train.mean()
+
+    for fit in fits:
+        y_pred['gtb{}'.format(fit['model_type'])] = fit['prediction']
+
+    # Save prediction
+    if not os.path.exists(res_folder):
+        os.makedirs(res_folder)
+    y_pred.to_hdf(res_folder+'y_pred.h5.tmp',key='df',mode='w')
+    os.replace(res_folder+'y_pred.h5.tmp', res_folder+'y_pred.h5')
+
+
+def prediction_report(report, area, target, y_test, res_folder, reference_res_folder, reference_data_folder, split_scheme):
+
+    # Compare R2 scores and predictions with a reference run (e.g. the data version prepared with float64 data)
+    y_pred = pd.read_hdf(res_folder + 'y_pred.h5')
+    for model in ['daily_profile', 'gtb_day_ahead', 'gtb_full']:
+        model_report = {'stage': '6_model_fit', 'area': area, 'name': '{}_{}'.format(target, model),
+                        'r2': r2_score(y_test, y_pred[model])}
+        if os.path.exists(reference_res_folder + 'y_pred.h5'):
+            reference_y_pred = pd.read_hdf(reference_res_folder + 'y_pred.h5').loc[:,model]
+            reference_y_test = split_frame(open_split_table(reference_data_folder),
+                                           read_split_rows(reference_data_folder, split_scheme)['test'], [target])[target]
+            model_report['reference_r2'] = r2_score(reference_y_test, reference_y_pred)
+            model_report['r2_deviation'] = abs(model_report['r2'] - model_report['reference_r2'])
+            model_report['max_abs_deviation'] = (y_pred[model] - reference_y_pred).abs().max()
+        report.append(model_report)
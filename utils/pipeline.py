@@ -0,0 +1,226 @@
+import pandas as pd
+import os
+import sys
+import json
+import glob
+import hashlib
+import subprocess
+
+from utils.split_store import open_split_table, split_frame
+
+
+# Environment variables used by the pipeline runner to pass the selected unit
+# (e.g. area and target) and the stage parameters to a stage script
+unit_variable = 'PIPELINE_UNIT'
+parameters_variable = 'PIPELINE_PARAMETERS'
+
+
+def pipeline_selection(name, default):
+
+    # Selection of the runner for the current stage execution (e.g. areas or targets),
+    # default if the script is run standalone
+    unit = json.loads(os.environ.get(unit_variable, '{}'))
+    if name in unit:
+        return unit[name]
+
+    return default
+
+
+def pipeline_parameter(name, default):
+
+    # Stage parameter as declared in the runner, default if the script is run standalone
+    parameters = json.loads(os.environ.get(parameters_variable, '{}'))
+    if name in parameters:
+        return parameters[name]
+
+    return default
+
+
+def _hash(*items):
+
+    sha1 = hashlib.sha1()
+    for item in items:
+        sha1.update(json.dumps(item, sort_keys=True, default=str).encode())
+
+    return sha1.hexdigest()
+
+
+def file_fingerprint(file, fingerprint_cache):
+
+    # SHA-1 hash of the file content (cached as long as size and modification time are unchanged)
+    stat = os.stat(file)
+    key = os.path.abspath(file)
+    cached = fingerprint_cache.get(key)
+    if cached is not None and cached['size']==stat.st_size and cached['mtime']==stat.st_mtime_ns:
+        return cached['hash']
+
+    sha1 = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            sha1.update(block)
+    fingerprint_cache[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': sha1.hexdigest()}
+
+    return sha1.hexdigest()
+
+
+def _spec_files(spec):
+
+    # Files that hold the data of a dict input
+    if spec.get('format')=='split_table':
+        return [spec['path'] + file for file in ['split_table.json', 'split_table.npy', 'split_index.npy']]
+
+    return [spec['path']]
+
+
+def input_fingerprint(spec, fingerprint_cache):
+
+    # Fingerprint of a stage input. An input is either a path (glob patterns are allowed) whose file
+    # contents are hashed or a dict with the path of a pandas HDF file (or of the version folder of a
+    # joined split table with 'format': 'split_table') and only the 'columns' (for a split table also
+    # a column group) or the 'nan_mask' (rows with any NaN) of the data that the stage actually depends
+    # on. Fingerprints of dicts are cached as long as size and modification time of the files are unchanged.
+    if isinstance(spec, str):
+        files = sorted(glob.glob(spec))
+        if not files:
+            return 'missing'
+        return _hash([[file, file_fingerprint(file, fingerprint_cache)] for file in files])
+
+    files = _spec_files(spec)
+    if not all(os.path.exists(file) for file in files):
+        return 'missing'
+    key = _hash(os.path.abspath(spec['path']), spec)
+    stats = [[os.stat(file).st_size, os.stat(file).st_mtime_ns] for file in files]
+    cached = fingerprint_cache.get(key)
+    if cached is not None and cached['stats']==stats:
+        return cached['hash']
+
+    if spec.get('format')=='split_table':
+        data = split_frame(open_split_table(spec['path']), None, spec.get('columns', 'full'))
+    else:
+        data = pd.read_hdf(spec['path'])
+        if 'columns' in spec:
+            data = data.loc[:,spec['columns']]
+    if spec.get('nan_mask', False):
+        data = data.isnull().any(axis=1)
+
+    names = list(data.columns) if isinstance(data, pd.DataFrame) else [data.name]
+    data_hash = _hash(list(map(str, names)),
+                      hashlib.sha1(pd.util.hash_pandas_object(data, index=True).values.tobytes()).hexdigest())
+    fingerprint_cache[key] = {'stats': stats, 'hash': data_hash}
+
+    return data_hash
+
+
+def _format(value, unit):
+
+    # Fill in the unit (e.g. '{area}') into paths, column names and selections
+    if isinstance(value, str):
+        return value.format(**unit)
+    if isinstance(value, list):
+        return [_format(item, unit) for item in value]
+    if isinstance(value, dict):
+        return {key: _format(item, unit) for key, item in value.items()}
+
+    return value
+
+
+def _unit_value(stage, name, unit):
+
+    # Declarations can be given for all units or as function of the unit
+    value = stage.get(name, [] if name in ['inputs', 'outputs'] else {})
+    if callable(value):
+        return value(unit)
+
+    return value
+
+
+def _lineage_file(output):
+
+    return output + '.lineage.json'
+
+
+def run_stage(stage, fingerprint_cache, force=False):
+
+    # Run a stage script for each of its units (e.g. areas) whose inputs, parameters or script changed.
+    # Inputs, outputs, selection and parameters are templates filled in with the unit (e.g. '{area}') or 
+    # functions of the unit. The script is told which unit to process via the selection (e.g. 
+    # {'areas': ['{area}']}). The lineage (stage key, fingerprints of script, parameters and inputs) is 
+    # saved next to each output.
+    # A stage can split its units into 'parts' (e.g. the targets of an area) that are processed by one
+    # run of the script: inputs and outputs are then declared per part (e.g. '{target}') and the 
+    # selection is a function of the unit and the parts that changed. The 'run_parameters' (e.g. the
+    # number of cores) are passed to the script as well, but do not change the results.
+    script_hash = file_fingerprint(stage['script'], fingerprint_cache)
+
+    for unit in stage['units']:
+
+        parameters = _format(_unit_value(stage, 'parameters', unit), unit)
+
+        # Parts whose outputs do not exist or were created with another key
+        changed_parts, lineages = [], []
+        for part in stage.get('parts', [{}]):
+            part_unit = dict(unit, **part)
+            inputs, outputs = [_format(_unit_value(stage, name, part_unit), part_unit) for name in ['inputs', 'outputs']]
+            input_hashes = [input_fingerprint(spec, fingerprint_cache) for spec in inputs]
+            key = _hash(stage['name'], part_unit, script_hash, parameters, input_hashes)
+
+            # Skip part if all outputs exist and were created with the same key
+            up_to_date = not force
+            for output in outputs:
+                if not up_to_date:
+                    break
+                if not os.path.exists(output) or not os.path.exists(_lineage_file(output)):
+                    up_to_date = False
+                    continue
+                with open(_lineage_file(output)) as f:
+                    up_to_date = json.load(f)['key']==key
+
+            if up_to_date:
+                print('{} {}: up to date'.format(stage['name'], part_unit))
+                continue
+
+            changed_parts.append(part)
+            lineages.append((outputs, {'key': key, 'stage': stage['name'], 'unit': part_unit,
+                                       'script': [stage['script'], script_hash], 'parameters': parameters,
+                                       'inputs': [[spec, input_hash] for spec, input_hash in zip(inputs, input_hashes)]}))
+
+        if not changed_parts:
+            continue
+
+        if 'parts' in stage:
+            selection = stage['selection'](unit, changed_parts)
+            print('{} {} {}: running'.format(stage['name'], unit, changed_parts))
+        else:
+            selection = _format(_unit_value(stage, 'selection', unit), unit)
+            print('{} {}: running'.format(stage['name'], unit))
+        env = dict(os.environ)
+        env[unit_variable] = json.dumps(selection)
+        env[parameters_variable] = json.dumps(dict(parameters, **_format(_unit_value(stage, 'run_parameters', unit), unit)))
+        subprocess.run([sys.executable, stage['script']], env=env, check=True)
+
+        # Record lineage with each output
+        for outputs, lineage in lineages:
+            lineage['created'] = pd.Timestamp.now().isoformat()
+            for output in outputs:
+                if os.path.exists(output):
+                    with open(_lineage_file(output), 'w') as f:
+                        json.dump(lineage, f, indent=4)
+                else:
+                    print('Output {} of {} was not created'.format(output, stage['name']))
+
+
+def run_pipeline(stages, fingerprint_cache_file, selected_stages=None, force=False):
+
+    if os.path.exists(fingerprint_cache_file):
+        with open(fingerprint_cache_file) as f:
+            fingerprint_cache = json.load(f)
+    else:
+        fingerprint_cache = {}
+
+    try:
+        for stage in stages:
+            if selected_stages is None or stage['name'] in selected_stages:
+                run_stage(stage, fingerprint_cache, force)
+    finally:
+        with open(fingerprint_cache_file, 'w') as f:
+            json.dump(fingerprint_cache, f)
@@ -0,0 +1,103 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+from glob import glob
+
+
+def save_split_table(version_folder, data, groups):
+
+    # Store the joined feature/target table of a data version once as column-major matrix
+    # (split_table.npy), its time index (split_index.npy) and the column names, dtypes and named
+    # column groups, e.g. {'full': [...], 'day_ahead': [...]} (split_table.json). Train-test splits are
+    # saved separately as row positions (see save_split). Splits of a previous table are removed.
+    for split_file in glob(version_folder + 'split_*.npz'):
+        os.remove(split_file)
+
+    matrix = np.asfortranarray(data.to_numpy(dtype=np.result_type(*data.dtypes.unique())))
+    with open(version_folder + 'split_table.npy.tmp', 'wb') as f:
+        np.save(f, matrix)
+    os.replace(version_folder + 'split_table.npy.tmp', version_folder + 'split_table.npy')
+
+    with open(version_folder + 'split_index.npy.tmp', 'wb') as f:
+        np.save(f, data.index.asi8)
+    os.replace(version_folder + 'split_index.npy.tmp', version_folder + 'split_index.npy')
+
+    metadata = {'columns': list(data.columns), 'dtypes': [str(dtype) for dtype in data.dtypes],
+                'groups': {name: list(columns) for name, columns in groups.items()},
+                'tz': str(data.index.tz) if data.index.tz is not None else None}
+    with open(version_folder + 'split_table.json.tmp', 'w') as f:
+        json.dump(metadata, f)
+    os.replace(version_folder + 'split_table.json.tmp', version_folder + 'split_table.json')
+
+
+def save_split(version_folder, scheme, train_rows, test_rows):
+
+    # Train-test split scheme (e.g. random split with a seed or a time-based fold) as row positions
+    # of the split table (the order of the rows is kept)
+    with open(version_folder + 'split_{}.npz.tmp'.format(scheme), 'wb') as f:
+        np.savez(f, train=np.asarray(train_rows, dtype=np.int64), test=np.asarray(test_rows, dtype=np.int64))
+    os.replace(version_folder + 'split_{}.npz.tmp'.format(scheme), version_folder + 'split_{}.npz'.format(scheme))
+
+
+def open_split_table(version_folder):
+
+    # Metadata, memory-mapped table and time index of a data version (nothing is read yet)
+    with open(version_folder + 'split_table.json') as f:
+        metadata = json.load(f)
+    matrix = np.load(version_folder + 'split_table.npy', mmap_mode='r')
+    index = pd.DatetimeIndex(np.load(version_folder + 'split_index.npy'), tz='UTC')
+    if metadata['tz'] is not None:
+        index = index.tz_convert(metadata['tz'])
+    else:
+        index = index.tz_localize(None)
+
+    return metadata, matrix, index
+
+
+def read_split_rows(version_folder, scheme):
+
+    # Row positions of the train and test set of a split scheme
+    with np.load(version_folder + 'split_{}.npz'.format(scheme)) as split:
+        return {part: split[part] for part in split.files}
+
+
+def _as_slice(positions):
+
+    # Consecutive positions as slice, so that indexing the memory-mapped matrix does not copy
+    positions = np.asarray(positions)
+    if positions.size>0 and (np.diff(positions)==1).all():
+        return slice(positions[0], positions[-1] + 1)
+
+    return positions
+
+
+def split_values(split_table, rows, columns):
+
+    # Values of the given rows (None for all rows) and columns (group name or column names).
+    # Consecutive rows (e.g. time-based folds) and column groups are memory-mapped slices,
+    # other row selections are copied.
+    metadata, matrix, index = split_table
+    if isinstance(columns, str):
+        columns = metadata['groups'][columns]
+    positions = _as_slice(pd.Index(metadata['columns']).get_indexer(columns))
+    if rows is None:
+        return matrix[:, positions]
+    rows = _as_slice(rows)
+    if isinstance(rows, slice) or isinstance(positions, slice):
+        return matrix[rows, positions]
+
+    return matrix[np.ix_(rows, positions)]
+
+
+def split_frame(split_table, rows, columns):
+
+    # Data frame of the given rows and columns with the time index and the dtypes of the saved data
+    metadata, matrix, index = split_table
+    if isinstance(columns, str):
+        columns = metadata['groups'][columns]
+    dtypes = dict(zip(metadata['columns'], metadata['dtypes']))
+    frame = pd.DataFrame(split_values(split_table, rows, columns), columns=columns,
+                         index=index if rows is None else index[rows])
+
+    return frame.astype({column: dtypes[column] for column in columns})
@@ -1,7 +1,80 @@
 import pandas as pd 
 import numpy as np 
 import os
+import json
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+
+def _hourly_windows(values, n_hours, offset, length):
+
+    # Strided (n_hours, length) view on a 1 Hz array, where row i starts at sample i*3600+offset
+    # (no data is copied, all rows have to lie within the array)
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if n_hours<=0:
+        return np.empty((0, length))
+    if offset<0 or (n_hours-1)*3600 + offset + length > values.shape[0]:
+        raise ValueError('Hourly windows exceed the range of the data')
+
+    step = values.strides[0]
+    windows = np.lib.stride_tricks.as_strided(values[offset:], shape=(n_hours, length),
+                                              strides=(3600*step, step), writeable=False)
+    return windows
+
+
+def _rocof_window_range(smooth_window_size, lookup_window_size, method):
+
+    # Samples around a full hour that enter the centered rolling windows, relative to the
+    # start of the preceding hour (the rolling mean at sample j covers samples
+    # j-smooth_window_size//2 to j+(smooth_window_size-1)//2)
+    lag = 5 if method=='frequency_smoothing' else 1
+    first = 3600 - lookup_window_size - smooth_window_size//2 - lag
+    length = 2*lookup_window_size + smooth_window_size + lag - 1
+
+    return first, length
+
+
+def _rocof_base(windows, method):
+
+    # Samples whose differences over the smoothing window yield the smoothed increments
+    # (the rolling mean of the increments is the increment over the whole smoothing window,
+    # and two rolling means 5 s apart only differ by the 5 samples entering and leaving the window)
+    if method=='frequency_smoothing':
+        return windows[:,4:] + windows[:,3:-1] + windows[:,2:-2] + windows[:,1:-3] + windows[:,:-4]
+    if method=='increment_smoothing':
+        return windows
+
+
+def _rocof_from_base(base, smooth_window_size, method):
+
+    df_dt = (base[:,smooth_window_size:] - base[:,:-smooth_window_size]) / smooth_window_size
+    if method=='frequency_smoothing':
+        df_dt = df_dt / 5.
+
+    # Pick the largest absolute value within the lookup window
+    ind_max = np.abs(df_dt).argmax(axis=1)
+    rocof = df_dt[np.arange(df_dt.shape[0]), ind_max]
+
+    return rocof
+
+
+def _rocof_frequency_smoothing(values, n_hours, smooth_window_size, lookup_window_size, chunk_hours=500):
+
+    # Smoothed frequency with pandas' rolling mean over the two hours around each full hour (as
+    # columns of a block of hours), so that the running sums have the same round-off as in the
+    # per-hour calculation. On quantized data (e.g. mHz) several samples often tie for the largest
+    # absolute RoCoF and the round-off decides which one (and which sign) is picked.
+    rocof = np.empty(n_hours)
+    for start in range(0, n_hours, chunk_hours):
+        hours = min(chunk_hours, n_hours - start)
+        windows = _hourly_windows(values[start*3600:], hours, 0, 7200)
+        smoothed = pd.DataFrame(windows.T).rolling(smooth_window_size, center=True).mean()
+        df_dt = smoothed.diff(periods=5).values[3600-lookup_window_size:3600+lookup_window_size].T
+        ind_max = np.abs(df_dt).argmax(axis=1)
+        rocof[start:start+hours] = df_dt[np.arange(hours), ind_max] / 5.
+        rocof[start:start+hours][np.isnan(df_dt).any(axis=1)] = np.nan
+
+    return rocof
+
 
 def calc_rocof(data,  smooth_window_size, lookup_window_size, method='increment_smoothing'):
   
@@ -12,39 +85,226 @@ def calc_rocof(data,  smooth_window_size, lookup_window_size, method='increment_
     full_hours = data.index[::3600]
     full_hours = full_hours[1:-1]
     
-    result = pd.Series(index = full_hours)
+    first, length = _rocof_window_range(smooth_window_size, lookup_window_size, method)
+    if first<0 or first+length>7200:
+        print('RoCoF windows exceed the neighbouring hours!')
+        return None
     
+    # Calculate RoCoF for all hours at once (NaN if any sample is missing)
     if method=='frequency_smoothing':
+        rocof = _rocof_frequency_smoothing(data.values, len(full_hours), smooth_window_size, lookup_window_size)
+    else:
+        windows = _hourly_windows(data.values, len(full_hours), first, length)
+        rocof = _rocof_from_base(_rocof_base(windows, method), smooth_window_size, method)
+        rocof[np.isnan(windows).any(axis=1)] = np.nan
+    
+    result = pd.Series(index = full_hours, data = rocof)
+    
+    return result
 
-        for i in np.arange(len(full_hours)):
 
+def calc_rocof_sweep(data, window_sizes, method='increment_smoothing'):
+    
+    if data.index[0].minute!=0 or data.index[0].second!=0:
+        print('Data is not starting with full hour!')
+        return None
+    
+    full_hours = data.index[::3600]
+    full_hours = full_hours[1:-1]
+    
+    # Sample range covering the windows of all (smooth_window_size, lookup_window_size)-pairs
+    window_ranges = [_rocof_window_range(smooth, lookup, method) for smooth, lookup in window_sizes]
+    first = min([start for start, length in window_ranges])
+    end = max([start+length for start, length in window_ranges])
+    if first<0 or end>7200:
+        print('RoCoF windows exceed the neighbouring hours!')
+        return None
+    
+    # Shared smoothing base and cumulative NaN counts for all pairs (with frequency smoothing,
+    # ties of the largest absolute RoCoF can resolve differently than in calc_rocof)
+    windows = _hourly_windows(data.values, len(full_hours), first, end-first)
+    base = _rocof_base(windows, method)
+    nan_count = np.zeros((windows.shape[0], windows.shape[1]+1), dtype=np.int64)
+    np.cumsum(np.isnan(windows), axis=1, out=nan_count[:,1:])
+    
+    # RoCoF for each pair from its slice of the shared data 
+    # (the base of a pair always has 2*lookup_window_size+smooth_window_size samples)
+    result = pd.DataFrame(index = full_hours,
+                          columns = pd.MultiIndex.from_tuples(window_sizes, names=['smooth_window_size',
+                                                                                   'lookup_window_size']),
+                          dtype = np.float64)
+    for (smooth, lookup), (start, length) in zip(window_sizes, window_ranges):
         
-            smoothed_snipped = data.iloc[i*3600:(i+2)*3600].rolling(smooth_window_size, center=True).mean()
+        offset = start - first
+        rocof = _rocof_from_base(base[:,offset:offset+2*lookup+smooth], smooth, method)
+        rocof[nan_count[:,offset+length] - nan_count[:,offset] > 0] = np.nan
+        result[(smooth, lookup)] = rocof
+    
+    return result
 
-            df_dt = smoothed_snipped.diff(periods=5).iloc[3600-lookup_window_size:3600+lookup_window_size]
-            
-            
-            if df_dt.isnull().any():
-                result.iloc[i]=np.nan
-            else:
-                result.iloc[i] = df_dt[df_dt.abs().idxmax()] / 5.   
 
-    if method=='increment_smoothing':
+def _hourly_integral(block):
+    
+    return np.nansum(block, axis=1)
 
-        for i in np.arange(len(full_hours)):
-            
-            df_dt = data.iloc[i*3600:(i+2)*3600].diff().rolling(smooth_window_size , center=True).mean()
-            df_dt = df_dt.iloc[3600-lookup_window_size:3600+lookup_window_size]
-                    
-            if df_dt.isnull().any():
-                result.iloc[i]=np.nan
-            else:
-                result.iloc[i] = df_dt[df_dt.abs().idxmax()]  
 
-    return result
+def _hourly_extreme(block):
+    
+    # Value with the largest absolute deviation (first one in case of ties, NaN if hour is empty)
+    abs_block = np.abs(block)
+    abs_block[np.isnan(abs_block)] = -1
+    ind_max = abs_block.argmax(axis=1)
+    extreme = block[np.arange(block.shape[0]), ind_max]
+    extreme[abs_block.max(axis=1)<0] = np.nan
+    return extreme
+
+
+def _hourly_msd(block):
+    
+    squares = block**2
+    valid = ~np.isnan(squares)
+    squares[~valid] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        msd = squares.sum(axis=1) / valid.sum(axis=1)
+    return msd
+
+
+# Hourly reductions of the (hours, 3600) frequency block
+# (each function maps a 2D block to one value per row)
+hourly_indicators = {'f_integral': _hourly_integral,
+                     'f_ext': _hourly_extreme,
+                     'f_msd': _hourly_msd}
 
 
-def make_frequency_data_hdf(path_to_frequency_csv, tso_name, frequency_hdf_folder, start_time, end_time, time_zone, delete_existing_hdf=False):
+def calc_hourly_indicators(data, extra_indicators=None, chunk_size=1000):
+    
+    if data.index[0].minute!=0 or data.index[0].second!=0:
+        print('Data is not starting with full hour!')
+        return None
+    
+    indicators = dict(hourly_indicators)
+    if extra_indicators:
+        indicators.update(extra_indicators)
+    
+    # Reshape gap-aligned 1 Hz data into full hours (without copying)
+    # and treat a trailing incomplete hour as a separate block
+    values = np.ascontiguousarray(data.values, dtype=np.float64)
+    n_full_hours = values.shape[0] // 3600
+    full_hours = values[:n_full_hours*3600].reshape(n_full_hours, 3600)
+    blocks = [full_hours[i:i+chunk_size] for i in range(0, n_full_hours, chunk_size)]
+    if values.shape[0] > n_full_hours*3600:
+        blocks.append(values[n_full_hours*3600:].reshape(1,-1))
+    
+    # Calculate all indicators and the NaN mask chunk-wise in a single pass over the data
+    results = {name: [] for name in indicators}
+    nan_mask = []
+    for block in blocks:
+        for name, reduction in indicators.items():
+            results[name].append(reduction(block))
+        nan_mask.append(np.isnan(block).any(axis=1))
+    
+    index = data.index[::3600]
+    hourly = pd.DataFrame(index=index, data={name: np.concatenate(res) for name, res in results.items()})
+    hours_with_nans = pd.Series(index=index, data=np.concatenate(nan_mask))
+    
+    return hourly, hours_with_nans
+
+
+def _read_frequency_csv(year, path_to_tso_csv):
+
+    # Decode one yearly csv file (with naive timestamps, unnamed like the streamed chunks)
+    print('Processing', year)
+    data = pd.read_csv(path_to_tso_csv, index_col=[0], header=None).iloc[:,0].rename(None)
+    data.index = pd.to_datetime(data.index)
+
+    return data
+
+
+def _read_frequency_csv_chunks(csv_files, chunk_size):
+
+    for year, path_to_tso_csv in csv_files:
+        print('Processing', year)
+        for chunk in pd.read_csv(path_to_tso_csv, index_col=[0], header=None, chunksize=chunk_size):
+            yield chunk.iloc[:,0].rename(None)
+
+
+def _localize_frequency_chunks(chunks, time_zone):
+
+    # Localize a stream of frequency chunks with naive timestamps. Timestamps at the end of a
+    # chunk that are ambiguous (DST fall-back) are held back until the next chunk completes
+    # them, such that ambiguous='infer' sees the whole repeated hour.
+    held_back = None
+    last_time = None
+
+    for chunk in chunks:
+
+        if held_back is not None:
+            chunk = pd.concat([held_back, chunk])
+        chunk.index = pd.to_datetime(chunk.index)
+
+        ambiguous = chunk.index.tz_localize(time_zone, ambiguous='NaT').isnull()
+        n_ready = len(chunk) - np.argmin(ambiguous[::-1]) if not ambiguous.all() else 0
+        held_back = chunk.iloc[n_ready:]
+        chunk = chunk.iloc[:n_ready]
+
+        if not chunk.empty:
+            chunk.index = chunk.index.tz_localize(time_zone, ambiguous='infer')
+            last_time = _validate_frequency_chunk(chunk, last_time)
+            yield chunk
+
+    if held_back is not None and not held_back.empty:
+        held_back.index = held_back.index.tz_localize(time_zone, ambiguous='infer')
+        _validate_frequency_chunk(held_back, last_time)
+        yield held_back
+
+
+def _validate_frequency_chunk(chunk, last_time):
+
+    # Check that timestamps are strictly increasing within and across chunks
+    if not chunk.index.is_monotonic_increasing or not chunk.index.is_unique:
+        print('Frequency data has unordered or duplicate timestamps between', chunk.index[0], 'and', chunk.index[-1])
+    if last_time is not None and chunk.index[0] <= last_time:
+        print('Frequency data is not continued in order at', chunk.index[0])
+
+    return chunk.index[-1]
+
+
+def _read_frequency_tables(table_files, chunk_size):
+
+    # Read yearly tables chunk-wise in the given order 
+    last_time = None
+    for table_file in table_files:
+        for chunk in pd.read_hdf(table_file, key='df', chunksize=chunk_size):
+            last_time = _validate_frequency_chunk(chunk, last_time)
+            yield chunk
+
+
+def _write_frequency_table(chunks, table_file):
+
+    # Append chunks to an HDF table and return its first and last timestamp
+    first_time, last_time = None, None
+    with pd.HDFStore(table_file, mode='w') as store:
+        for chunk in chunks:
+            store.append('df', chunk, format='table')
+            if first_time is None:
+                first_time = chunk.index[0]
+            last_time = chunk.index[-1]
+
+    return first_time, last_time
+
+
+def _stream_frequency_csv(year, path_to_tso_csv, time_zone, chunk_size, table_file):
+
+    # Stream one yearly csv file into its own table 
+    # (DST transitions never straddle the yearly files, so each file can be localized on its own)
+    chunks = _localize_frequency_chunks(_read_frequency_csv_chunks([(year, path_to_tso_csv)], chunk_size), time_zone)
+    _write_frequency_table(chunks, table_file)
+
+    return table_file
+
+
+def make_frequency_data_hdf(path_to_frequency_csv, tso_name, frequency_hdf_folder, start_time, end_time, time_zone, 
+                            delete_existing_hdf=False, chunk_size=None, n_jobs=1):
     
     print('\nConverting frequency data to hdf ', tso_name, '...')
     
@@ -57,26 +317,64 @@ def make_frequency_data_hdf(path_to_frequency_csv, tso_name, frequency_hdf_folde
     
     if not hdf_file or delete_existing_hdf:
         
-        data = pd.Series(dtype=np.float)
-
-        for year in year_index.year:
-            print('Processing', year)
-            path_to_tso_csv = path_to_frequency_csv + '{}_cleansed/{}/'.format(year, tso_name) + '{}.zip'.format(year)
-            year_data = pd.read_csv(path_to_tso_csv, index_col=[0], header=None, squeeze=True)
-            data = data.append(year_data)
-
-        data.index = pd.to_datetime(data.index)
-        data.index = data.index.tz_localize(time_zone, ambiguous='infer') 
+        csv_files = [(year, path_to_frequency_csv + '{}_cleansed/{}/'.format(year, tso_name) + '{}.zip'.format(year))
+                     for year in year_index.year]
+        tmp_file = frequency_hdf_folder + 'streaming_{}.h5.tmp'.format(tso_name)
+        if not csv_files:
+            raise ValueError('No yearly frequency csv files of {} between {} and {}'.format(tso_name, start_time, end_time))
         
-        data_start = data.index[0].strftime('%Y-%m-%d')
-        data_end = data.index[-1].strftime('%Y-%m-%d')
+        if chunk_size is None:
+            
+            # Read all years into memory (decoding years in parallel processes if n_jobs>1)
+            # and localize the merged data such that ambiguous='infer' sees all years
+            if n_jobs>1:
+                with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                    data = list(pool.map(_read_frequency_csv, *zip(*csv_files)))
+            else:
+                data = [_read_frequency_csv(year, path_to_tso_csv) for year, path_to_tso_csv in csv_files]
+            data = pd.concat(data)
+            if data.empty:
+                raise ValueError('No frequency data in the csv files of {}'.format(tso_name))
+            
+            data.index = data.index.tz_localize(time_zone, ambiguous='infer') 
+            
+            data_start = data.index[0].strftime('%Y-%m-%d')
+            data_end = data.index[-1].strftime('%Y-%m-%d')
+        
+        else:
+            
+            # Stream chunks of all years into an appendable table 
+            # (peak memory is bounded by the chunk size)
+            if n_jobs>1:
+                
+                # Stream years into seperate tables in parallel and merge them in order
+                year_files = [frequency_hdf_folder + 'streaming_{}_{}.h5.tmp'.format(tso_name, year) for year, _ in csv_files]
+                with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                    list(pool.map(_stream_frequency_csv, *zip(*csv_files), [time_zone]*len(csv_files),
+                                  [chunk_size]*len(csv_files), year_files))
+                first_time, last_time = _write_frequency_table(_read_frequency_tables(year_files, chunk_size), tmp_file)
+                for year_file in year_files:
+                    os.remove(year_file)
+                    
+            else:
+                chunks = _localize_frequency_chunks(_read_frequency_csv_chunks(csv_files, chunk_size), time_zone)
+                first_time, last_time = _write_frequency_table(chunks, tmp_file)
+            
+            if first_time is None:
+                os.remove(tmp_file)
+                raise ValueError('No frequency data in the csv files of {}'.format(tso_name))
+            data_start = first_time.strftime('%Y-%m-%d')
+            data_end = last_time.strftime('%Y-%m-%d')
         
         if hdf_file and delete_existing_hdf:
             os.remove(hdf_file[0])
         
         hdf_file = frequency_hdf_folder + 'cleansed_{}_to_{}.h5'.format(data_start, data_end)
         
-        data.to_hdf(hdf_file, key='df') 
+        if chunk_size is None:
+            data.to_hdf(hdf_file, key='df') 
+        else:
+            os.replace(tmp_file, hdf_file)
         
     else:
         hdf_file = hdf_file[0]
@@ -92,3 +390,476 @@ def make_frequency_data_hdf(path_to_frequency_csv, tso_name, frequency_hdf_folde
         
 
 
+
+
+def write_frequency_store(data, store_file, nominal_frequency=50.):
+    
+    # Compact store for 1 Hz frequency data: The deviations from the nominal frequency are saved
+    # as integer millihertz array (.npy) and the time index is replaced by start time, sample period
+    # and time zone in a metadata file (.json). NaNs are saved as the smallest integer value.
+    period = data.index[1] - data.index[0]
+    time_index = pd.date_range(data.index[0], data.index[-1], freq=period)
+    if not data.index.equals(time_index):
+        data = data.reindex(time_index)
+    
+    nominal_mhz = int(round(nominal_frequency*1000))
+    deviations = np.round(data.values*1000) - nominal_mhz
+    if np.nanmax(np.abs((deviations + nominal_mhz)/1000. - data.values)) > 1e-9:
+        raise ValueError('Frequency data has a finer resolution than 1 mHz')
+    
+    max_deviation = np.nanmax(np.abs(deviations))
+    dtype = np.int16 if max_deviation < np.iinfo(np.int16).max else np.int32
+    sentinel = np.iinfo(dtype).min
+    
+    values = np.full(deviations.shape, sentinel, dtype=dtype)
+    valid = ~np.isnan(deviations)
+    values[valid] = deviations[valid]
+    
+    # Atomic writes of the metadata and the array (the array is written last as its 
+    # modification time marks the store as complete)
+    metadata = {'start': data.index[0].tz_convert('UTC').isoformat(),
+                'period': period.isoformat(),
+                'time_zone': str(data.index.tz),
+                'nominal_mhz': nominal_mhz,
+                'sentinel': int(sentinel),
+                'n_samples': int(values.shape[0])}
+    with open(store_file[:-4] + '.json.tmp', 'w') as f:
+        json.dump(metadata, f, indent=4)
+    os.replace(store_file[:-4] + '.json.tmp', store_file[:-4] + '.json')
+    with open(store_file + '.tmp', 'wb') as f:
+        np.save(f, values)
+    os.replace(store_file + '.tmp', store_file)
+
+
+def _open_frequency_store(store_file):
+    
+    # Metadata and memory-mapped millihertz array of a compact store (nothing is read yet)
+    with open(store_file[:-4] + '.json') as f:
+        metadata = json.load(f)
+    values = np.load(store_file, mmap_mode='r')
+    
+    return metadata, values
+
+
+def _frequency_store_offsets(metadata, start_time=None, end_time=None):
+    
+    # Array offsets [first, last) of the samples between start_time and end_time (both inclusive
+    # as for .loc, naive times refer to the time zone of the store)
+    store_start = pd.Timestamp(metadata['start'])
+    period = pd.Timedelta(metadata['period']).value
+    
+    offsets = []
+    for time, default, rounding in [(start_time, 0, -1), (end_time, metadata['n_samples'], 1)]:
+        if time is None:
+            offsets.append(default)
+            continue
+        time = pd.Timestamp(time)
+        if time.tz is None:
+            time = time.tz_localize(metadata['time_zone'])
+        delta = (time - store_start).value
+        offset = -(-delta // period) if rounding<0 else delta // period + 1
+        offsets.append(int(min(max(offset, 0), metadata['n_samples'])))
+    
+    return offsets[0], max(offsets)
+
+
+def _frequency_store_slice(store_file, start_time=None, end_time=None):
+    
+    # Zero-copy slice of the memory-mapped millihertz array and its time index
+    metadata, values = _open_frequency_store(store_file)
+    first, last = _frequency_store_offsets(metadata, start_time, end_time)
+    
+    period = pd.Timedelta(metadata['period'])
+    time_index = pd.date_range(pd.Timestamp(metadata['start']) + first*period, periods=last-first,
+                               freq=period).tz_convert(metadata['time_zone'])
+    
+    return metadata, values[first:last], time_index
+
+
+def read_frequency_store(store_file, start_time=None, end_time=None):
+    
+    # Only the requested time range is read from the memory-mapped store
+    metadata, values, time_index = _frequency_store_slice(store_file, start_time, end_time)
+    
+    # Convert millihertz deviations back to frequency in Hz
+    # (dividing the integer millihertz by 1000 reproduces the parsed csv values exactly)
+    data = (values + float(metadata['nominal_mhz'])) / 1000.
+    data[values==metadata['sentinel']] = np.nan
+    
+    return pd.Series(index=time_index, data=data)
+
+
+def make_frequency_data_store(hdf_file):
+    
+    # Create the compact store next to the HDF file (if not existent or older than the HDF file).
+    # Returns None for frequency data with a finer resolution than 1 mHz, which cannot be stored.
+    store_file = hdf_file[:-3] + '.npy'
+    
+    if not os.path.exists(store_file) or os.path.getmtime(store_file) < os.path.getmtime(hdf_file):
+        print('Converting frequency data to compact store ', store_file, '...')
+        try:
+            write_frequency_store(pd.read_hdf(hdf_file), store_file)
+        except ValueError as error:
+            print('No compact store for {}: {}'.format(hdf_file, error))
+            return None
+        
+    return store_file
+
+
+def _nan_runs(values, sentinel, chunk_size=10**7):
+    
+    # Sorted (start, length)-runs of missing samples, found chunk-wise
+    # (runs are continued across chunk boundaries)
+    starts, ends = [], []
+    previous = np.zeros(1, dtype=bool)
+    for first in range(0, values.shape[0], chunk_size):
+        missing = values[first:first+chunk_size]==sentinel
+        change = np.diff(np.concatenate((previous, missing)).astype(np.int8))
+        starts.append(np.flatnonzero(change==1) + first)
+        ends.append(np.flatnonzero(change==-1) + first)
+        previous = missing[-1:]
+    if previous[0]:
+        ends.append(np.array([values.shape[0]]))
+    
+    starts = np.concatenate(starts) if starts else np.array([], dtype=np.int64)
+    ends = np.concatenate(ends) if ends else np.array([], dtype=np.int64)
+    
+    return np.column_stack((starts, ends-starts)).astype(np.int64)
+
+
+def make_gap_index(store_file):
+    
+    # Create the index of NaN gaps next to the frequency store and HDF file 
+    # (if not existent or older than the store)
+    gap_file = store_file[:-4] + '_gaps.npy'
+    
+    if not os.path.exists(gap_file) or os.path.getmtime(gap_file) < os.path.getmtime(store_file):
+        print('Indexing NaN gaps of frequency data ', gap_file, '...')
+        metadata, values = _open_frequency_store(store_file)
+        with open(gap_file + '.tmp', 'wb') as f:
+            np.save(f, _nan_runs(values, metadata['sentinel']))
+        os.replace(gap_file + '.tmp', gap_file)
+    
+    return gap_file
+
+
+def read_gap_index(gap_file):
+    
+    return np.load(gap_file)
+
+
+def window_is_clean(gaps, first, last):
+    
+    # Check if samples [first, last) of the store contain no NaN (binary search over the gaps)
+    i = np.searchsorted(gaps[:,0], last, side='left') - 1
+    
+    return i<0 or gaps[i,0] + gaps[i,1] <= first
+
+
+def hours_with_gaps(store_file, gap_file, start_time=None, end_time=None):
+    
+    # Hours between start_time and end_time that contain at least one NaN 
+    # (as hours_with_nans, but calculated from the gaps without reading any samples)
+    metadata, _ = _open_frequency_store(store_file)
+    first, last = _frequency_store_offsets(metadata, start_time, end_time)
+    gaps = read_gap_index(gap_file)
+    
+    # Hour numbers (since epoch) of store offsets
+    store_start = pd.Timestamp(metadata['start']).value
+    period = pd.Timedelta(metadata['period']).value
+    hour = pd.Timedelta('1H').value
+    def hour_of(offset):
+        return (store_start + offset*period) // hour
+    
+    first_hour = hour_of(first)
+    n_hours = hour_of(last-1) - first_hour + 1 if last>first else 0
+    
+    # Mark hours from the first to last sample of each gap within the range
+    in_range = gaps[np.searchsorted(gaps[:,0]+gaps[:,1], first, side='right'):
+                    np.searchsorted(gaps[:,0], last, side='left')]
+    gap_starts = np.maximum(in_range[:,0], first)
+    gap_ends = np.minimum(in_range[:,0] + in_range[:,1], last) - 1
+    marks = np.zeros(n_hours+1, dtype=np.int64)
+    np.add.at(marks, hour_of(gap_starts) - first_hour, 1)
+    np.add.at(marks, hour_of(gap_ends) - first_hour + 1, -1)
+    
+    hour_index = pd.to_datetime((first_hour + np.arange(n_hours))*hour, utc=True).tz_convert(metadata['time_zone'])
+    
+    return pd.Series(index=hour_index, data=np.cumsum(marks[:-1])>0)
+
+
+def _block_aggregates(blocks, sentinel):
+    
+    # Mergeable aggregates of integer millihertz blocks (one row per block)
+    valid = blocks!=sentinel
+    values = np.where(valid, blocks, 0).astype(np.int64)
+    
+    abs_values = np.where(valid, np.abs(values), -1)
+    ind_max = abs_values.argmax(axis=1)
+    extreme = values[np.arange(blocks.shape[0]), ind_max]
+    extreme[~valid.any(axis=1)] = sentinel
+    
+    aggregates = {'count': valid.sum(axis=1),
+                  'nan_count': (~valid).sum(axis=1),
+                  'sum': values.sum(axis=1),
+                  'sum_squares': (values**2).sum(axis=1),
+                  'extreme': extreme}
+    return aggregates
+
+
+def make_aggregate_pyramid(store_file, base_resolution='1min', chunk_size=10**4):
+    
+    # Create the base level of per-block aggregates (count, NaN count, sum, sum of squares and 
+    # signed extreme value of the millihertz deviations) next to the frequency store. Blocks are 
+    # aligned to multiples of the base resolution, partial blocks at the start and end only 
+    # aggregate the existing samples.
+    pyramid_file = store_file[:-4] + '_pyramid.npz'
+    
+    if not os.path.exists(pyramid_file) or os.path.getmtime(pyramid_file) < os.path.getmtime(store_file):
+        
+        print('Aggregating frequency data ', pyramid_file, '...')
+        metadata, values = _open_frequency_store(store_file)
+        sentinel = metadata['sentinel']
+        
+        resolution = pd.Timedelta(base_resolution).value
+        period = pd.Timedelta(metadata['period']).value
+        if resolution % period != 0:
+            raise ValueError('Base resolution is not a multiple of the sample period')
+        block_size = resolution // period
+        
+        # Positions in a padded array that starts at a full block
+        store_start = pd.Timestamp(metadata['start']).value
+        first_block = store_start - store_start % resolution
+        head = (store_start - first_block) // period
+        n_padded = head + values.shape[0]
+        n_blocks = -(-n_padded // block_size)
+        
+        # Aggregate chunks of blocks (padding with NaNs at the start and end)
+        aggregates = []
+        for block in range(0, n_blocks, chunk_size):
+            first = block*block_size - head
+            last = min(block + chunk_size, n_blocks)*block_size - head
+            chunk = values[max(first,0):min(last, values.shape[0])]
+            chunk = np.concatenate((np.full(max(-first,0), sentinel, dtype=values.dtype), chunk,
+                                    np.full(max(last-values.shape[0],0), sentinel, dtype=values.dtype)))
+            aggregates.append(_block_aggregates(chunk.reshape(-1, block_size), sentinel))
+        aggregates = {name: np.concatenate([agg[name] for agg in aggregates]) for name in aggregates[0]}
+        
+        # Padded samples are not missing samples
+        aggregates['nan_count'][0] -= head
+        aggregates['nan_count'][-1] -= n_blocks*block_size - n_padded
+        
+        with open(pyramid_file + '.tmp', 'wb') as f:
+            np.savez(f, first_block=first_block, resolution=resolution, 
+                     time_zone=metadata['time_zone'], sentinel=sentinel, **aggregates)
+        os.replace(pyramid_file + '.tmp', pyramid_file)
+    
+    return pyramid_file
+
+
+def read_aggregate_pyramid(pyramid_file, resolution=None):
+    
+    # Read the base level and roll it up to a coarser resolution (multiple of the base resolution).
+    # As for pd.Grouper, groups of days follow the local calendar days and shorter groups 
+    # start at the local midnight of the first day.
+    with np.load(pyramid_file) as f:
+        pyramid = {name: f[name] for name in f.files}
+    pyramid['time_zone'] = str(pyramid['time_zone'])
+    pyramid['sentinel'] = int(pyramid['sentinel'])
+    pyramid['times'] = int(pyramid['first_block']) + np.arange(pyramid['count'].shape[0])*int(pyramid['resolution'])
+    
+    if resolution is None or pd.Timedelta(resolution).value==pyramid['resolution']:
+        return pyramid
+    
+    resolution = pd.Timedelta(resolution).value
+    if resolution % pyramid['resolution'] != 0:
+        raise ValueError('Resolution is not a multiple of the base resolution')
+    
+    # Assign blocks to groups
+    times = pd.to_datetime(pyramid['times'], utc=True).tz_convert(pyramid['time_zone'])
+    calendar_days = resolution % pd.Timedelta('1D').value == 0
+    if calendar_days:
+        times = times.tz_localize(None)
+    origin = times[0].normalize()
+    groups = (times.values.astype(np.int64) - origin.value) // resolution
+    group_starts = np.flatnonzero(np.diff(groups, prepend=groups[0]-1))
+    
+    group_times = origin + pd.to_timedelta(groups[group_starts]*resolution)
+    if calendar_days:
+        group_times = group_times.tz_localize(pyramid['time_zone'])
+    group_times = group_times.tz_convert('UTC').values.astype(np.int64)
+    
+    # Merge all blocks of a group
+    rolled_up = {'times': group_times, 'time_zone': pyramid['time_zone'], 'sentinel': pyramid['sentinel']}
+    for name in ['count', 'nan_count', 'sum', 'sum_squares']:
+        rolled_up[name] = np.add.reduceat(pyramid[name], group_starts)
+    
+    # Signed extreme value with the largest absolute value (the first one in case of ties)
+    abs_extreme = np.where(pyramid['count']>0, np.abs(pyramid['extreme']), -1)
+    group_max = np.maximum.reduceat(abs_extreme, group_starts)
+    group_sizes = np.diff(np.append(group_starts, abs_extreme.shape[0]))
+    candidates = np.flatnonzero(abs_extreme==np.repeat(group_max, group_sizes))
+    _, first_candidates = np.unique(np.repeat(np.arange(group_starts.shape[0]), group_sizes)[candidates], 
+                                    return_index=True)
+    rolled_up['extreme'] = pyramid['extreme'][candidates[first_candidates]]
+    
+    return rolled_up
+
+
+def calc_aggregate_indicators(pyramid_file, resolution='1H', start_time=None, end_time=None):
+    
+    # Stability indicators (f_integral, f_ext, f_msd in Hz) and NaN mask at a multiple of the 
+    # base resolution, derived from the aggregates without reading any samples 
+    # (groups are selected by their start time)
+    pyramid = read_aggregate_pyramid(pyramid_file, resolution)
+    
+    index = pd.to_datetime(pyramid['times'], utc=True).tz_convert(pyramid['time_zone'])
+    count = pyramid['count']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        indicators = pd.DataFrame(index=index, data={
+            'f_integral': pyramid['sum'] / 1000.,
+            'f_ext': np.where(count>0, pyramid['extreme'] / 1000., np.nan),
+            'f_msd': pyramid['sum_squares'] / 1e6 / count})
+    with_nans = pd.Series(index=index, data=pyramid['nan_count']>0)
+    
+    indicators, with_nans = indicators.loc[start_time:end_time], with_nans.loc[start_time:end_time]
+    
+    return indicators, with_nans
+
+
+class OnlineStabilityIndicators:
+    
+    # Incremental calculation of the hourly stability indicators (f_integral, f_ext, f_msd, f_rocof)
+    # from a live 1 Hz feed of frequency deviations. Only ring buffers for the RoCoF smoothing are 
+    # kept and each sample is processed in constant time. An hour is emitted as soon as its last 
+    # sample arrived (the RoCoF window around the start of the hour is complete by then).
+    # The RoCoF values with increment smoothing are identical to calc_rocof, with frequency smoothing
+    # they agree up to round-off (ties of the largest absolute RoCoF can resolve differently, see
+    # _rocof_frequency_smoothing). The other indicators agree with calc_hourly_indicators up to
+    # round-off of the running sums.
+    
+    columns = ['f_integral', 'f_ext', 'f_rocof', 'f_msd', 'with_nans']
+    
+    def __init__(self, smooth_window_size, lookup_window_size, method='increment_smoothing'):
+        
+        first, length = _rocof_window_range(smooth_window_size, lookup_window_size, method)
+        if first<0 or first+length>7200:
+            raise ValueError('RoCoF windows exceed the neighbouring hours')
+        
+        self.smooth_window_size = smooth_window_size
+        self.lookup_window_size = lookup_window_size
+        self.method = method
+        
+        # Ring buffers of the latest samples and 5-sample sums (frequency smoothing)
+        self._samples = np.full(max(smooth_window_size+1, 5), np.nan)
+        self._sums = np.full(smooth_window_size+1, np.nan)
+        
+        self._n_samples = 0
+        self._first_time = None
+        self._next_time = None
+        self._reset_hour()
+        self._reset_rocof()
+    
+    def _reset_hour(self):
+        
+        self._count, self._sum, self._sum_squares = 0, 0., 0.
+        self._extreme, self._extreme_abs = np.nan, -1.
+        self._with_nans = False
+        self._hour_rocof = np.nan
+    
+    def _reset_rocof(self):
+        
+        self._rocof, self._rocof_abs = np.nan, -1.
+        self._rocof_count = 0
+        self._rocof_nan = False
+    
+    def _add_sample(self, value):
+        
+        j = self._n_samples
+        self._n_samples += 1
+        
+        # Hourly aggregates
+        if np.isnan(value):
+            self._with_nans = True
+        else:
+            self._count += 1
+            self._sum += value
+            self._sum_squares += value**2
+            if abs(value) > self._extreme_abs:
+                self._extreme, self._extreme_abs = value, abs(value)
+        
+        # Smoothed increment at sample j-(smooth_window_size-1)//2 (same operations as calc_rocof_sweep)
+        w = self.smooth_window_size
+        n_samples, n_sums = self._samples.shape[0], self._sums.shape[0]
+        self._samples[j % n_samples] = value
+        df_dt = None
+        if self.method=='frequency_smoothing' and j>=4:
+            samples = [self._samples[(j-k) % n_samples] for k in range(5)]
+            new_sum = samples[0] + samples[1] + samples[2] + samples[3] + samples[4]
+            self._sums[(j-4) % n_sums] = new_sum
+            if j-4>=w:
+                df_dt = (new_sum - self._sums[(j-4-w) % n_sums]) / w / 5.
+        if self.method=='increment_smoothing' and j>=w:
+            df_dt = (value - self._samples[(j-w) % n_samples]) / w
+        
+        # Largest absolute increment within the lookup window around the start of the hour
+        if df_dt is not None:
+            offset = (j - (w-1)//2) % 3600
+            if offset < self.lookup_window_size or offset >= 3600-self.lookup_window_size:
+                if offset==3600-self.lookup_window_size:
+                    self._reset_rocof()
+                self._rocof_count += 1
+                if np.isnan(df_dt):
+                    self._rocof_nan = True
+                elif abs(df_dt) > self._rocof_abs:
+                    self._rocof, self._rocof_abs = df_dt, abs(df_dt)
+                if offset==self.lookup_window_size-1:
+                    rocof_complete = self._rocof_count==2*self.lookup_window_size and not self._rocof_nan
+                    self._hour_rocof = self._rocof if rocof_complete else np.nan
+        
+        # Emit the hour after its last sample
+        if j % 3600 == 3599:
+            record = {'f_integral': self._sum,
+                      'f_ext': self._extreme if self._count>0 else np.nan,
+                      'f_rocof': self._hour_rocof,
+                      'f_msd': self._sum_squares / self._count if self._count>0 else np.nan,
+                      'with_nans': self._with_nans}
+            self._reset_hour()
+            return self._first_time + pd.Timedelta(hours=j//3600), record
+    
+    def _emitted(self, records):
+        
+        index = [time for time, record in records]
+        return pd.DataFrame(index=pd.DatetimeIndex(index), data=[record for time, record in records],
+                            columns=self.columns)
+    
+    def update(self, data):
+        
+        # Add a batch of samples (pd.Series with 1 Hz time index) and return all completed hours.
+        # Missing samples are filled with NaN, the feed starts at the first full hour.
+        if self._first_time is None:
+            full_hours = data.index[(data.index.minute==0) & (data.index.second==0)]
+            if len(full_hours)==0:
+                return self._emitted([])
+            self._first_time = full_hours[0]
+            self._next_time = full_hours[0]
+        
+        data = data.loc[self._next_time:]
+        if data.empty:
+            return self._emitted([])
+        time_index = pd.date_range(self._next_time, data.index[-1], freq='S')
+        values = data.reindex(time_index).values.astype(np.float64)
+        self._next_time = time_index[-1] + pd.Timedelta('1S')
+        
+        records = []
+        for value in values:
+            record = self._add_sample(value)
+            if record is not None:
+                records.append(record)
+        
+        return self._emitted(records)
+    
+    def add(self, time, value):
+        
+        # Add a single sample
+        return self.update(pd.Series(index=pd.DatetimeIndex([time]), data=[value]))